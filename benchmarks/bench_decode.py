@@ -0,0 +1,169 @@
+"""Decode time and peak memory of search pages, full versus lean, with each JSON serializer
+
+Pages are recorded from the mock cluster (or loaded from a directory of raw search or
+scroll responses saved from a real one, with --responses), both as the cluster sends
+them by default and trimmed by the filter_path ElasticAPI now asks for. Then:
+
+* decode: seconds to decode every page with json and, if it's installed, orjson
+* memory: peak traced memory of building the columns the old way, keeping every full
+  hit until the end, and the lean way, decoding and adding one trimmed page at a time
+
+Results are printed (or saved with --output) as JSON.
+
+    python benchmarks/bench_decode.py --docs 100000 --output decode.json
+"""
+import gc
+import glob
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.mock_es import MockCluster, apply_filter_path  # noqa: E402
+from es_utils.api_response_parser import ColumnBuilder  # noqa: E402
+from es_utils.es_api import ElasticAPI  # noqa: E402
+
+
+def record_pages(docs, width, page_size):
+    """Page through the mock cluster's corpus like a point in time search, as raw response bytes"""
+
+    cluster = MockCluster(docs=docs, width=width)
+    pages = []
+    search_after = None
+
+    while True:
+        body = {"pit": {"id": "bench"}, "size": page_size}
+
+        if search_after is not None:
+            body["search_after"] = search_after
+
+        response = cluster.search({}, body)
+        hits = response["hits"]["hits"]
+
+        if not hits:
+            return pages
+
+        # Real clusters send these for every hit too, and the lean path leaves them out
+        for hit in hits:
+            hit["_ignored"] = []
+
+        pages.append(json.dumps(response).encode("utf-8"))
+        search_after = hits[-1]["sort"]
+
+
+def load_pages(directory):
+    pages = []
+
+    for path in sorted(glob.glob(os.path.join(directory, "*.json"))):
+        with open(path, "rb") as f:
+            pages.append(f.read())
+
+    return pages
+
+
+def serializers():
+    loaders = {"json": json.loads}
+
+    try:
+        import orjson
+        loaders["orjson"] = orjson.loads
+
+    except ImportError:
+        pass
+
+    return loaders
+
+
+def time_decode(pages, loads, repeat):
+    times = []
+
+    for _ in range(repeat):
+        started = time.perf_counter()
+
+        for page in pages:
+            loads(page)
+
+        times.append(time.perf_counter() - started)
+
+    return statistics.median(times)
+
+
+def peak_memory(build):
+    gc.collect()
+    tracemalloc.start()
+
+    try:
+        build()
+        return tracemalloc.get_traced_memory()[1]
+
+    finally:
+        tracemalloc.stop()
+
+
+def retain_full(pages, loads):
+    """The old way: keep every decoded response until the search ends, then build the columns"""
+
+    responses = [loads(page) for page in pages]
+    builder = ColumnBuilder()
+
+    for response in responses:
+        builder.add_page(response["hits"]["hits"])
+
+    return builder.finish()
+
+
+def lean_streaming(pages, loads):
+    """The lean way: each trimmed page is decoded, added to the columns, and dropped"""
+
+    builder = ColumnBuilder()
+
+    for page in pages:
+        builder.add_page(loads(page).get("hits", {}).get("hits", []))
+
+    return builder.finish()
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--docs", type=int, default=50_000, help="Documents to record (default: 50000)")
+    parser.add_argument("--width", type=int, default=10, help="Extra fields per document (default: 10)")
+    parser.add_argument("--page-size", type=int, default=1000, help="Hits per page (default: 1000)")
+    parser.add_argument("--responses", metavar="DIR", help="Use the raw responses (*.json) in DIR instead of \
+        recording them from the mock cluster")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per decode measurement (default: 3)")
+    parser.add_argument("--output", help="Write the results to this JSON file as well")
+    args = parser.parse_args()
+
+    full = load_pages(args.responses) if args.responses else record_pages(args.docs, args.width, args.page_size)
+    filter_path = ElasticAPI("localhost", 9200, "http", "user", "pass")._filter_path()
+    lean = [json.dumps(apply_filter_path(json.loads(page), filter_path)).encode("utf-8") for page in full]
+    hits = sum(len(json.loads(page).get("hits", {}).get("hits", [])) for page in full)
+
+    results = {"python": sys.version.split()[0], "pages": len(full), "hits": hits,
+               "full_bytes": sum(map(len, full)), "lean_bytes": sum(map(len, lean)),
+               "decode_seconds": {}, "hits_per_second": {}, "peak_memory_bytes": {}}
+
+    for name, loads in serializers().items():
+        for shape, pages in (("full", full), ("lean", lean)):
+            seconds = time_decode(pages, loads, args.repeat)
+            results["decode_seconds"][f"{name}_{shape}"] = seconds
+            results["hits_per_second"][f"{name}_{shape}"] = hits / seconds if seconds else None
+
+        results["peak_memory_bytes"][f"{name}_retain_full"] = peak_memory(lambda: retain_full(full, loads))
+        results["peak_memory_bytes"][f"{name}_lean_streaming"] = peak_memory(lambda: lean_streaming(lean, loads))
+
+    output = json.dumps(results, indent=2)
+    print(output)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Import time and first use overhead of the es integration
+
+Every measurement runs in a fresh interpreter, so nothing is already imported, and is
+repeated to take the median. The results are printed (or saved with --output) as JSON
+so they can be compared between releases.
+
+    python benchmarks/bench_import.py --repeat 5 --output import_times.json
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+from argparse import ArgumentParser
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# name -> (setup that isn't timed, code that is)
+MEASUREMENTS = {
+    "import_es_utils": ("", "import es_utils.es_api, es_utils.user_input_parser, es_utils.api_response_parser"),
+    "import_es_full": ("", "import es_core.es_full"),
+    "build_input_parser": ("from es_utils.user_input_parser import UserInputParser", "UserInputParser()"),
+    "construct_api": ("from es_utils.es_api import ElasticAPI",
+                      "ElasticAPI('localhost', 9200, 'http', 'user', 'pass')"),
+    "first_client": ("from es_utils.es_api import ElasticAPI\n"
+                     "api = ElasticAPI('localhost', 9200, 'http', 'user', 'pass')", "api.session"),
+    "import_pandas": ("", "import pandas")
+}
+
+TIMER = """
+import sys, time
+sys.path.insert(0, {repo!r})
+{setup}
+started = time.perf_counter()
+{code}
+print(time.perf_counter() - started)
+"""
+
+
+def measure(setup, code, repeat):
+    """Time code in a fresh interpreter, repeat times
+
+    Returns:
+        list: the elapsed seconds of each run, or None if the code can't run here
+    """
+
+    times = []
+
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, "-c", TIMER.format(repo=REPO, setup=setup, code=code)],
+                                capture_output=True, text=True)
+
+        if result.returncode != 0:
+            return None
+
+        times.append(float(result.stdout.strip().splitlines()[-1]))
+
+    return times
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per measurement (default: 5)")
+    parser.add_argument("--output", help="Write the results to this JSON file as well")
+    args = parser.parse_args()
+
+    results = {"python": sys.version.split()[0], "repeat": args.repeat, "seconds": {}}
+
+    for name, (setup, code) in MEASUREMENTS.items():
+        times = measure(setup, code, args.repeat)
+        results["seconds"][name] = None if times is None else {"median": statistics.median(times),
+                                                               "min": min(times), "max": max(times)}
+
+    output = json.dumps(results, indent=2)
+    print(output)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+"""End to end benchmarks of the %es magics, against the offline mock cluster
+
+Each scenario runs a cell (or line) through the real magics in an IPython shell, in a fresh
+worker process, so its peak RSS is its own. The mock cluster serves a synthetic corpus of
+--docs documents with --width extra fields, or a recorded one (--corpus, one JSON document
+per line). For each scenario it reports:
+
+* hits, and hits per second over the whole cell
+* peak RSS of the worker, and its RSS once everything was imported
+* time to first row: from the start of the query until its first page came back
+* time per stage, from the query's stats: took, transport, decode, parse and frame
+
+Every number is the median of --repeat runs, after --warmup runs that aren't counted.
+Results are printed (or saved with --output) as JSON, with the commit they were run on,
+and --compare shows how each scenario changed against an earlier results file.
+
+    python benchmarks/bench_magics.py --docs 50000 --output before.json
+    python benchmarks/bench_magics.py --docs 50000 --compare before.json
+
+The magics need jupyter_integration_base (integration_core) installed; without it, each
+scenario reports the import error instead.
+"""
+import io
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from argparse import SUPPRESS, ArgumentParser
+from contextlib import redirect_stderr, redirect_stdout
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from benchmarks.mock_es import MockCluster  # noqa: E402
+
+INSTANCE = "bench"
+
+# name -> ("cell" or "line", what to run). Cells skip the result cache, so every run does the work
+SCENARIOS = {
+    "search": ("cell", "search -i bench -d logs -c bypass\n*"),
+    "search_sliced": ("cell", "search -i bench -d logs -c bypass -s 4\n*"),
+    "search_scroll": ("cell", "search -i bench -d logs -c bypass -p scroll\n*"),
+    "search_no_score": ("cell", "search -i bench -d logs -c bypass --no-score\n*"),
+    "search_typed": ("cell", "search -i bench -d logs -c bypass -t\n*"),
+    "msearch": ("cell", "msearch -i bench -d logs -c bypass\nevent.action: login\nevent.action: logout"),
+    "aggregate": ("cell", "aggregate -i bench -d logs -c bypass -g terms:host.name -m avg:bytes\n*"),
+    "esql": ("cell", "esql -i bench -c bypass\nFROM logs"),
+    "sql": ("cell", "sql -i bench -c bypass\nSELECT * FROM logs"),
+    "get_indices": ("line", "get_indices -i bench -r")
+}
+
+# The query stats reported for each scenario
+STAGES = ("took_ms", "transport_seconds", "decode_seconds", "parse_seconds", "frame_seconds", "first_page_seconds")
+
+# What --compare reports, and whether bigger is better
+COMPARED = {"hits_per_second": True, "cell_seconds": False, "first_row_seconds": False, "peak_rss_bytes": False}
+
+
+def peak_rss():
+    """This process's peak resident set size in bytes (ru_maxrss is KiB on Linux, bytes on macOS)"""
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def connect(es, host, port):
+    """Point the bench instance at the mock cluster, and connect to it without a password prompt"""
+
+    os.environ[f"JUPYTER_ES_CONN_URL_{INSTANCE.upper()}"] = f"http://{INSTANCE}@{host}:{port}"
+
+    if INSTANCE not in es.instances:
+        es.parse_instances()
+
+    inst = es.instances[INSTANCE]
+    inst["enc_pass"] = None
+
+    if es.customAuth(INSTANCE) != 0:
+        raise RuntimeError(f"Couldn't connect to the mock cluster at {host}:{port}")
+
+    # What %es connect does once customAuth succeeds
+    inst["connected"] = True
+
+
+def run_worker(args):
+    """Run one scenario in this process and print its measurements as JSON"""
+
+    kind, code = SCENARIOS[args.worker]
+    output = io.StringIO()
+    runs = []
+
+    # The magics display their results and messages, keep them out of our JSON
+    with redirect_stdout(output), redirect_stderr(output):
+        from IPython.core.interactiveshell import InteractiveShell
+        from es_core.es_full import Es
+
+        ipy = InteractiveShell.instance()
+        es = Es(ipy, debug=False)
+        ipy.register_magics(es)
+        connect(es, args.host, args.port)
+
+        # The same as %es set es_max_results
+        es.opts["es_max_results"][0] = args.max_results
+        imported_rss = peak_rss()
+
+        for run in range(args.warmup + args.repeat):
+            history = es.stats_history.records.get(INSTANCE, [])
+            recorded = len(history)
+            started = time.perf_counter()
+
+            if kind == "cell":
+                ipy.run_cell_magic("es", INSTANCE, code)
+            else:
+                ipy.run_line_magic("es", code)
+
+            elapsed = time.perf_counter() - started
+            history = es.stats_history.records.get(INSTANCE, [])
+
+            if kind == "cell" and len(history) == recorded:
+                raise RuntimeError(f"The cell didn't run a query: {output.getvalue()[-500:]}")
+
+            if run >= args.warmup:
+                runs.append((elapsed, history[-1] if kind == "cell" else {}))
+
+    cell_seconds = statistics.median(elapsed for elapsed, _ in runs)
+    hits = runs[-1][1].get("hits")
+    result = {
+        "hits": hits,
+        "cell_seconds": cell_seconds,
+        "hits_per_second": hits / cell_seconds if hits and cell_seconds else None,
+        "first_row_seconds": None,
+        "imported_rss_bytes": imported_rss,
+        "peak_rss_bytes": peak_rss(),
+        "stages": {}
+    }
+
+    for stage in STAGES:
+        values = [record[stage] for _, record in runs if record.get(stage) is not None]
+        result["stages"][stage] = statistics.median(values) if values else None
+
+    result["first_row_seconds"] = result["stages"]["first_page_seconds"]
+
+    print(json.dumps(result))
+
+
+def run_scenario(name, cluster, args):
+    """Run a scenario in a fresh worker process
+
+    Returns:
+        dict: its measurements, or the error it failed with
+    """
+
+    command = [sys.executable, os.path.abspath(__file__), "--worker", name, "--host", cluster.host,
+               "--port", str(cluster.port), "--max-results", str(args.max_results), "--repeat", str(args.repeat),
+               "--warmup", str(args.warmup)]
+    result = subprocess.run(command, capture_output=True, text=True, cwd=REPO)
+
+    if result.returncode != 0:
+        lines = result.stderr.strip().splitlines()
+
+        return {"error": lines[-1] if lines else f"exited with {result.returncode}"}
+
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def git_commit():
+    result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=REPO)
+
+    return result.stdout.strip() if result.returncode == 0 else None
+
+
+def compare(results, baseline_path, tolerance):
+    """Show each scenario's change against an earlier run, and list the regressions past tolerance
+
+    Returns:
+        list: "scenario: metric" for each regression
+    """
+
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    regressions = []
+    lines = [f"Compared with {baseline_path} (commit {baseline.get('commit')}):"]
+
+    for name, result in results["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+
+        if not before or "error" in before or "error" in result:
+            continue
+
+        for metric, bigger_is_better in COMPARED.items():
+            old, new = before.get(metric), result.get(metric)
+
+            if not old or new is None:
+                continue
+
+            change = (new - old) / old
+            worse = -change if bigger_is_better else change
+            flag = "  REGRESSION" if worse > tolerance else ""
+
+            if flag:
+                regressions.append(f"{name}: {metric}")
+
+            lines.append(f"  {name:16} {metric:18} {old:14.4f} -> {new:14.4f} ({change:+.1%}){flag}")
+
+    print("\n".join(lines), file=sys.stderr)
+
+    return regressions
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--docs", type=int, default=20_000, help="Documents in the mock index (default: 20000)")
+    parser.add_argument("--width", type=int, default=10, help="Extra fields per document (default: 10)")
+    parser.add_argument("--corpus", help="Serve the documents in this file (one JSON document per line) \
+        instead of synthetic ones, up to --docs of them")
+    parser.add_argument("--latency", type=float, default=0.002,
+                        help="Seconds the mock cluster waits per request (default: 0.002)")
+    parser.add_argument("--max-results", type=int, help="es_max_results for the runs (default: --docs)")
+    parser.add_argument("--scenarios", help=f"A comma separated list of scenarios to run (default: all of \
+        {', '.join(SCENARIOS)})")
+    parser.add_argument("--repeat", type=int, default=3, help="Counted runs per scenario (default: 3)")
+    parser.add_argument("--warmup", type=int, default=1, help="Uncounted runs per scenario first (default: 1)")
+    parser.add_argument("--output", help="Write the results to this JSON file as well")
+    parser.add_argument("--compare", metavar="RESULTS", help="Compare with an earlier results file, and exit \
+        with an error if anything got worse by more than --tolerance")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="How much worse a metric can get before --compare fails (default: 0.1)")
+    parser.add_argument("--worker", help=SUPPRESS)
+    parser.add_argument("--host", help=SUPPRESS)
+    parser.add_argument("--port", type=int, help=SUPPRESS)
+    args = parser.parse_args()
+
+    if args.max_results is None:
+        args.max_results = args.docs
+
+    if args.worker:
+        run_worker(args)
+
+        return
+
+    names = args.scenarios.split(",") if args.scenarios else list(SCENARIOS)
+    unknown = [name for name in names if name not in SCENARIOS]
+
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+
+    results = {"python": sys.version.split()[0], "commit": git_commit(), "docs": args.docs, "width": args.width,
+               "corpus": args.corpus, "latency": args.latency, "max_results": args.max_results,
+               "repeat": args.repeat, "warmup": args.warmup, "scenarios": {}}
+
+    with MockCluster(docs=args.docs, width=args.width, latency=args.latency, corpus=args.corpus) as cluster:
+        results["docs"] = len(cluster.docs)
+
+        for name in names:
+            results["scenarios"][name] = run_scenario(name, cluster, args)
+
+    output = json.dumps(results, indent=2)
+    print(output)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+    if args.compare and compare(results, args.compare, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Server work per page of scored versus non-scoring searches, against the offline mock cluster
+
+The mock cluster counts the matching documents each request makes a shard visit, and how
+many of those it scores, and can charge a cost per visited document (--doc-cost) so that
+work shows up in the timings. Each configuration pulls the whole index, and reports its
+median time, hits per second, and the documents examined and scored per page. Results are
+printed (or saved with --output) as JSON.
+
+    python benchmarks/bench_scoring.py --docs 50000 --doc-cost 0.000002 --output scoring.json
+"""
+import json
+import os
+import statistics
+import sys
+import time
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.mock_es import MockCluster  # noqa: E402
+from es_utils.es_api import ElasticAPI  # noqa: E402
+
+# name -> search options
+CONFIGURATIONS = {
+    "pit_scored": {"paginate": "pit", "score": True},
+    "pit_no_score": {"paginate": "pit", "score": False},
+    "scroll_scored": {"paginate": "scroll", "score": True},
+    "scroll_no_score": {"paginate": "scroll", "score": False},
+    "pit_no_score_time_range": {"paginate": "pit", "score": False, "time_from": "2024-01-01T00:00:00+00:00",
+                                "time_to": "2024-01-08T00:00:00+00:00"}
+}
+
+
+def run_search(api, options, args):
+    pages = api.search(index="logs", query="*", time_field="@timestamp", es_scroll_size=args.page_size,
+                       es_scroll_time="1m", es_max_results=sys.maxsize, **options)
+    hits = 0
+    count = 0
+
+    for page in pages:
+        hits += len(page)
+        count += 1
+
+    return hits, count
+
+
+def measure(cluster, api, options, args):
+    """Pull the index repeat times with one configuration
+
+    Returns:
+        dict: the median seconds and hits per second, and the server work of one run
+    """
+
+    times = []
+    cluster.reset_stats()
+
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        hits, pages = run_search(api, options, args)
+        times.append(time.perf_counter() - started)
+
+    work = {stat: cluster.stats[stat] // args.repeat for stat in ("requests", "examined_docs", "scored_docs")}
+
+    return {
+        "options": options,
+        "hits": hits,
+        "pages": pages,
+        "median_seconds": statistics.median(times),
+        "hits_per_second": hits / statistics.median(times),
+        **work,
+        "examined_docs_per_page": work["examined_docs"] / max(pages, 1),
+        "scored_docs_per_page": work["scored_docs"] / max(pages, 1)
+    }
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--docs", type=int, default=20_000, help="Documents in the mock index (default: 20000)")
+    parser.add_argument("--width", type=int, default=10, help="Extra fields per document (default: 10)")
+    parser.add_argument("--latency", type=float, default=0.002,
+                        help="Seconds the mock cluster waits per request (default: 0.002)")
+    parser.add_argument("--doc-cost", type=float, default=0.000001,
+                        help="Seconds the mock cluster spends per document it visits (default: 0.000001)")
+    parser.add_argument("--page-size", type=int, default=1000, help="Hits per page (default: 1000)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per configuration (default: 3)")
+    parser.add_argument("--output", help="Write the results to this JSON file as well")
+    args = parser.parse_args()
+
+    results = {"python": sys.version.split()[0], "docs": args.docs, "width": args.width, "latency": args.latency,
+               "doc_cost": args.doc_cost, "page_size": args.page_size, "repeat": args.repeat,
+               "configurations": {}}
+
+    with MockCluster(docs=args.docs, width=args.width, latency=args.latency, doc_cost=args.doc_cost) as cluster:
+        api = ElasticAPI(cluster.host, cluster.port, "http", "user", "pass")
+
+        for name, options in CONFIGURATIONS.items():
+            results["configurations"][name] = measure(cluster, api, options, args)
+
+    output = json.dumps(results, indent=2)
+    print(output)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
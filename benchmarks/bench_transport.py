@@ -0,0 +1,102 @@
+"""Throughput of a search under different transport settings, against the offline mock cluster
+
+Each configuration (a set of instance connection options) runs the same sliced search
+and reports how long it took, the bytes that crossed the wire, and how many connections
+the client opened. A second ElasticAPI is then built with the same options, as a reconnect
+would, to check it reuses the first one's connections. Results are printed (or saved with
+--output) as JSON.
+
+    python benchmarks/bench_transport.py --docs 50000 --latency 0.005 --output transport.json
+"""
+import json
+import os
+import statistics
+import sys
+import time
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.mock_es import MockCluster  # noqa: E402
+from es_utils.es_api import ElasticAPI  # noqa: E402
+
+# name -> instance connection options
+CONFIGURATIONS = {
+    "default": {},
+    "compressed": {"compress": "true"},
+    "single_connection": {"pool_size": "1"},
+    "compressed_pool_20": {"compress": "true", "pool_size": "20"}
+}
+
+
+def run_search(api, args):
+    pages = api.search(index="logs", query="*", slices=args.slices, es_scroll_size=args.page_size,
+                       es_scroll_time="1m", es_max_results=sys.maxsize)
+
+    return sum(len(page) for page in pages)
+
+
+def measure(cluster, options, args):
+    """Run the search repeat times with one configuration
+
+    Returns:
+        dict: the median seconds and hits per second, and the wire bytes and connections of one run
+    """
+
+    ElasticAPI.clients.clear()
+    api = ElasticAPI(cluster.host, cluster.port, "http", "user", "pass", **options)
+    run_search(api, args)
+
+    times = []
+    cluster.reset_stats()
+
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        hits = run_search(api, args)
+        times.append(time.perf_counter() - started)
+
+    wire = {stat: cluster.stats[stat] // args.repeat for stat in ("requests", "request_bytes", "response_bytes")}
+
+    # A reconnect with the same options should open no new connections
+    cluster.reset_stats()
+    run_search(ElasticAPI(cluster.host, cluster.port, "http", "user", "pass", **options), args)
+
+    return {
+        "options": options,
+        "hits": hits,
+        "median_seconds": statistics.median(times),
+        "hits_per_second": hits / statistics.median(times),
+        **wire,
+        "connections_after_reconnect": cluster.stats["connections"]
+    }
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--docs", type=int, default=20_000, help="Documents in the mock index (default: 20000)")
+    parser.add_argument("--width", type=int, default=10, help="Extra fields per document (default: 10)")
+    parser.add_argument("--latency", type=float, default=0.002,
+                        help="Seconds the mock cluster waits per request (default: 0.002)")
+    parser.add_argument("--slices", type=int, default=4, help="Slices per search (default: 4)")
+    parser.add_argument("--page-size", type=int, default=1000, help="Hits per page (default: 1000)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per configuration (default: 3)")
+    parser.add_argument("--output", help="Write the results to this JSON file as well")
+    args = parser.parse_args()
+
+    results = {"python": sys.version.split()[0], "docs": args.docs, "width": args.width, "latency": args.latency,
+               "slices": args.slices, "page_size": args.page_size, "repeat": args.repeat, "configurations": {}}
+
+    with MockCluster(docs=args.docs, width=args.width, latency=args.latency) as cluster:
+        for name, options in CONFIGURATIONS.items():
+            results["configurations"][name] = measure(cluster, options, args)
+
+    output = json.dumps(results, indent=2)
+    print(output)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,945 @@
+"""A stand-in Elasticsearch cluster for running the benchmarks offline
+
+It serves a synthetic corpus over real HTTP, so the client, transport, compression and
+connection pooling all do the work they would against a cluster. It understands just
+enough of the API for the integration's commands: points in time with search_after (sorted
+on _shard_doc or a date field) and slices, scrolls, _msearch, _mapping, _cat/indices, ES|QL
+(as Arrow or columnar JSON) and SQL with cursors, and terms, date_histogram and composite
+aggregations with the metrics aggregate uses. Every document matches every query string, and
+range filters on a date field and filter_path are applied. ES|QL and SQL queries return every
+field, honouring only a LIMIT.
+
+The corpus is synthetic (make_docs), or recorded: a file of one JSON document per line, such
+as a search exported with -o out.ndjson, with a mapping guessed from its values.
+
+It also keeps a rough account of the work a real shard would do for each request: the
+matching documents it has to visit (examined_docs), and how many of those it has to score
+(scored_docs), with an optional cost per visited document so that work shows up in timings.
+
+    with MockCluster(docs=50000, width=20, latency=0.005) as cluster:
+        api = ElasticAPI(cluster.host, cluster.port, "http", "user", "pass")
+        ...
+        print(cluster.stats)
+"""
+import gzip
+import json
+import random
+import re
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from threading import Lock, Thread
+from urllib.parse import parse_qs, urlparse
+
+ACTIONS = ["login", "logout", "download", "upload", "delete", "update"]
+
+
+def make_docs(docs, width, seed=0, first=0):
+    """Build a reproducible corpus of docs documents, each with width extra keyword fields
+
+    Each document is 37 seconds newer than the one before it, counting from first.
+    """
+
+    rand = random.Random(seed + first)
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+    return [{
+        "@timestamp": (start + timedelta(seconds=i * 37)).isoformat(),
+        "host": {"name": f"web{i % 20:02d}", "ip": f"10.0.{i % 256}.{rand.randrange(256)}"},
+        "user": {"name": f"user{rand.randrange(500)}"},
+        "event": {"action": rand.choice(ACTIONS), "duration": rand.randrange(1, 10_000)},
+        "bytes": rand.randrange(100, 1_000_000),
+        "message": " ".join(rand.choice(ACTIONS) for _ in range(8)),
+        **{f"field{j:02d}": f"value-{rand.randrange(1000)}" for j in range(width)}
+    } for i in range(first, first + docs)]
+
+
+@lru_cache(maxsize=None)
+def epoch_millis(value):
+    """A date as epoch milliseconds, from epoch millis or ISO 8601"""
+
+    if isinstance(value, (int, float)):
+        return value
+
+    return int(value) if value.isdigit() else datetime.fromisoformat(value).timestamp() * 1000
+
+
+def synthetic_mapping(width):
+    """The mapping of make_docs' documents"""
+
+    return {
+        "@timestamp": {"type": "date"},
+        "host": {"properties": {"name": {"type": "keyword"}, "ip": {"type": "ip"}}},
+        "user": {"properties": {"name": {"type": "keyword"}}},
+        "event": {"properties": {"action": {"type": "keyword"}, "duration": {"type": "long"}}},
+        "bytes": {"type": "long"},
+        "message": {"type": "text", "fields": {"keyword": {"type": "keyword", "ignore_above": 256}}},
+        **{f"field{j:02d}": {"type": "keyword"} for j in range(width)}
+    }
+
+
+def load_corpus(path, limit=None):
+    """Read a recorded corpus, one JSON document per line
+
+    A line that's a whole hit (with a _source) counts as its _source.
+    """
+
+    docs = []
+
+    with open(path) as f:
+        for line in f:
+            if limit is not None and len(docs) >= limit:
+                break
+
+            if line.strip():
+                doc = json.loads(line)
+                docs.append(doc["_source"] if isinstance(doc.get("_source"), dict) else doc)
+
+    return docs
+
+
+def infer_mapping(docs, sample=1000):
+    """Guess a mapping for recorded documents from the values of the first sample of them"""
+
+    properties = {}
+
+    def guess(value):
+        if isinstance(value, list):
+            return guess(value[0]) if value else None
+        if isinstance(value, bool):
+            return "boolean"
+        if isinstance(value, int):
+            return "long"
+        if isinstance(value, float):
+            return "double"
+        if not isinstance(value, str):
+            return None
+
+        try:
+            datetime.fromisoformat(value)
+            return "date"
+
+        except ValueError:
+            return "text" if " " in value or len(value) > 64 else "keyword"
+
+    def walk(doc, into):
+        for name, value in doc.items():
+            if isinstance(value, dict):
+                walk(value, into.setdefault(name, {"properties": {}})["properties"])
+            elif name not in into and guess(value) is not None:
+                into[name] = {"type": guess(value)}
+
+    for doc in docs[:sample]:
+        walk(doc, properties)
+
+    return properties
+
+
+def field_value(doc, field):
+    """A document's value for a dotted field name, from either a flat key or nested objects"""
+
+    if field in doc:
+        return doc[field]
+
+    value = doc
+
+    for part in field.split("."):
+        value = value.get(part) if isinstance(value, dict) else None
+
+    return value
+
+
+def interval_millis(interval):
+    """A fixed interval like 30s, 15m or 2h in milliseconds"""
+
+    units = {"ms": 1, "s": 1000, "m": 60_000, "h": 3_600_000, "d": 86_400_000}
+    unit = "ms" if interval.endswith("ms") else interval[-1]
+
+    return int(interval[:-len(unit)]) * units[unit]
+
+
+def calendar_floor(millis, interval):
+    """The start of the calendar minute, hour, day, week, month, quarter or year a time falls in"""
+
+    if interval in ("1m", "1h", "1d"):
+        return int(millis) // interval_millis(interval) * interval_millis(interval)
+
+    when = datetime.fromtimestamp(millis / 1000, tz=timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+
+    if interval == "1w":
+        when -= timedelta(days=when.weekday())
+    elif interval == "1M":
+        when = when.replace(day=1)
+    elif interval == "1q":
+        when = when.replace(month=(when.month - 1) // 3 * 3 + 1, day=1)
+    else:
+        when = when.replace(month=1, day=1)
+
+    return int(when.timestamp() * 1000)
+
+
+def percentile(numbers, percent):
+    """A percentile by linear interpolation between the closest ranks, like the TDigest gives for small sets"""
+
+    if not numbers:
+        return None
+
+    ordered = sorted(numbers)
+    rank = (len(ordered) - 1) * percent / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def apply_filter_path(payload, paths):
+    """Keep only the dotted paths of a response that filter_path asked for"""
+
+    if isinstance(payload, list):
+        return [apply_filter_path(item, paths) for item in payload]
+
+    if not isinstance(payload, dict):
+        return payload
+
+    kept = {}
+
+    for key, value in payload.items():
+        if key in paths:
+            kept[key] = value
+            continue
+
+        nested = [path[len(key) + 1:] for path in paths if path.startswith(key + ".")]
+
+        if nested:
+            value = apply_filter_path(value, nested)
+
+            if value not in ({}, []):
+                kept[key] = value
+
+    return kept
+
+
+class MockCluster:
+    """A threaded HTTP server that answers like a small Elasticsearch cluster
+
+    Args:
+        docs (int): how many documents are in the index
+        width (int): extra fields per document, to make hits bigger
+        latency (float): seconds to wait before answering each request, like a network round trip
+        index (str): the name of the one index the cluster holds
+        doc_cost (float): seconds of extra work for every matching document a request visits
+        corpus (str): serve the documents recorded in this file (see load_corpus) instead of
+            synthetic ones, up to docs of them
+    """
+
+    def __init__(self, docs=10_000, width=10, latency=0.0, index="logs", doc_cost=0.0, corpus=None):
+        self.index = index
+        self.width = width
+        self.docs = load_corpus(corpus, docs) if corpus else make_docs(docs, width)
+        self.properties = infer_mapping(self.docs) if corpus else synthetic_mapping(width)
+        self.latency = latency
+        self.doc_cost = doc_cost
+        self.lock = Lock()
+        self.ids = count(1)
+        self.pits = set()
+        self.scrolls = {}
+        self.cursors = {}
+        self.stats = Counter()
+        self.server = None
+        self.thread = None
+
+    @property
+    def host(self):
+        return self.server.server_address[0]
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def start(self):
+        handler = type("Handler", (MockHandler,), {"cluster": self})
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.server.daemon_threads = True
+        self.thread = Thread(target=self.server.serve_forever, name="mock-es", daemon=True)
+        self.thread.start()
+
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def tally(self, stat, amount=1):
+        with self.lock:
+            self.stats[stat] += amount
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats.clear()
+
+    def add_docs(self, docs):
+        """Index docs more documents, newer than every one already in the cluster"""
+
+        with self.lock:
+            self.docs = self.docs + make_docs(docs, self.width, first=len(self.docs))
+
+    def new_id(self, prefix):
+        with self.lock:
+            return f"{prefix}-{next(self.ids)}"
+
+    # The API -----------------------------------------------------------------------------
+
+    def info(self, params, body):
+        return {"name": "mock", "cluster_name": "mock", "version": {"number": "8.12.0"},
+                "tagline": "You Know, for Search"}
+
+    def cat_indices(self, params, body):
+        return [{"index": self.index, "health": "green", "docs.count": str(len(self.docs)),
+                 "store.size": str(len(json.dumps(self.docs))), "creation.date": "1704067200000"}]
+
+    def mapping(self, params, body):
+        return {self.index: {"mappings": {"properties": self.properties}}}
+
+    def open_pit(self, params, body):
+        pit_id = self.new_id("pit")
+
+        with self.lock:
+            self.pits.add(pit_id)
+
+        return {"id": pit_id}
+
+    def close_pit(self, params, body):
+        with self.lock:
+            freed = body.get("id") in self.pits
+            self.pits.discard(body.get("id"))
+
+        return {"succeeded": True, "num_freed": int(freed)}
+
+    def search(self, params, body):
+        """Answer a search, a point in time search, or the first page of a scroll"""
+
+        started = time.perf_counter()
+        size = int(params.get("size", body.get("size", 10)))
+        query = body.get("query") or {}
+
+        # random_score shuffles the matches, the same way every time for a given seed
+        if "function_score" in query:
+            positions = self.matching(body.get("slice"), query["function_score"].get("query"))
+            random.Random(query["function_score"].get("random_score", {}).get("seed")).shuffle(positions)
+        else:
+            positions = self.matching(body.get("slice"), query)
+
+        total = len(positions)
+        # A point in time search without a sort is in _shard_doc order, like on a cluster
+        sort = body.get("sort") or (["_shard_doc"] if "pit" in body else [])
+
+        if any(self.sort_field(entry) not in ("_doc", "_shard_doc", "_score") for entry in sort):
+            positions.sort(key=lambda pos: self.sort_values(pos, sort))
+
+        if body.get("search_after"):
+            after = body["search_after"]
+            positions = [pos for pos in positions if self.sort_values(pos, sort) > after]
+
+        scored = self.scored(query, body.get("sort"))
+        self.work(len(positions[:size]), len(positions), total, scored, body.get("track_total_hits", 10000))
+
+        if "scroll" in params:
+            scroll_id = self.new_id("scroll")
+
+            with self.lock:
+                self.scrolls[scroll_id] = (positions[size:], size, scored, body)
+
+            response = self.hits(positions[:size], body, started, bool(body.get("sort")), total)
+            response["_scroll_id"] = scroll_id
+        else:
+            response = self.hits(positions[:size], body, started, "pit" in body, total)
+
+        if "pit" in body:
+            response["pit_id"] = body["pit"]["id"]
+
+        if body.get("profile"):
+            response["profile"] = self.profile(query, total)
+
+        aggs = body.get("aggs") or body.get("aggregations")
+
+        if aggs:
+            # Aggregating visits every match
+            self.tally("examined_docs", total)
+            response["aggregations"] = self.aggregations(positions, aggs)
+
+        return response
+
+    def scroll(self, params, body):
+        started = time.perf_counter()
+
+        with self.lock:
+            positions, size, scored, search = self.scrolls[body["scroll_id"]]
+            self.scrolls[body["scroll_id"]] = (positions[size:], size, scored, search)
+
+        self.work(len(positions[:size]), len(positions), None, scored, False)
+        response = self.hits(positions[:size], search, started, bool(search.get("sort")))
+        response["_scroll_id"] = body["scroll_id"]
+
+        return response
+
+    def clear_scroll(self, params, body):
+        ids = body.get("scroll_id") or []
+
+        with self.lock:
+            for scroll_id in [ids] if isinstance(ids, str) else ids:
+                self.scrolls.pop(scroll_id, None)
+
+        return {"succeeded": True, "num_freed": len(ids)}
+
+    def msearch(self, params, lines):
+        searches = [json.loads(line) for line in lines if line.strip()]
+
+        return {"took": 1, "responses": [self.msearch_one(body) for body in searches[1::2]]}
+
+    def msearch_one(self, body):
+        # Like a cluster, reject the client's search() keyword names that aren't body keys (source for _source)
+        if "source" in body:
+            return {"error": {"type": "parsing_exception", "reason": "Unknown key for a START_OBJECT in [source]."},
+                    "status": 400}
+
+        return dict(self.search({}, body), status=200)
+
+    def matching(self, search_slice=None, query=None):
+        positions = range(len(self.docs))
+
+        if search_slice:
+            positions = [pos for pos in positions if pos % search_slice["max"] == search_slice["id"]]
+
+        for clause in self.filters(query):
+            for field, bounds in clause.get("range", {}).items():
+                positions = [pos for pos in positions if self.in_range(self.docs[pos].get(field), bounds)]
+
+        return list(positions)
+
+    def filters(self, query):
+        """The filter clauses of a query, looking inside function_score and constant_score"""
+
+        query = query or {}
+
+        for wrapper, inner in (("function_score", "query"), ("constant_score", "filter")):
+            if wrapper in query:
+                return self.filters(query[wrapper].get(inner))
+
+        return (query.get("bool") or {}).get("filter") or []
+
+    def sort_field(self, entry):
+        return entry if isinstance(entry, str) else next(iter(entry))
+
+    def sort_values(self, pos, sort):
+        """A document's sort values, all ascending
+
+        A date field sorts on its epoch millis (missing ones last), _doc and _shard_doc on the
+        document's position.
+        """
+
+        values = []
+
+        for entry in sort:
+            field = self.sort_field(entry)
+
+            if field in ("_doc", "_shard_doc"):
+                values.append(pos)
+
+            elif field != "_score":
+                value = self.docs[pos].get(field)
+                values.append(2 ** 63 - 1 if value is None else int(epoch_millis(value)))
+
+        return values
+
+    def scored(self, query, sort):
+        """Whether a search has to score its matches: a query outside filter context, sorted on _score"""
+
+        if "constant_score" in (query or {}):
+            return False
+
+        return not sort or any("_score" in (key if isinstance(key, str) else list(key)) for key in sort)
+
+    def work(self, returned, remaining, total, scored, track_total_hits):
+        """Account for the documents a request makes a shard visit
+
+        A scored search has to visit every remaining match to find the best ones. Otherwise
+        it can stop once the page is full, unless it's also counting the total matches.
+        """
+
+        if scored:
+            examined = remaining
+        elif track_total_hits is False or total is None:
+            examined = returned
+        elif track_total_hits is True:
+            examined = total
+        else:
+            examined = min(total, max(int(track_total_hits), returned))
+
+        self.tally("examined_docs", examined)
+        self.tally("scored_docs", examined if scored else 0)
+
+        if self.doc_cost:
+            time.sleep(self.doc_cost * examined)
+
+    def in_range(self, value, bounds):
+        """Check a document's date against a range filter's bounds, in epoch millis or ISO 8601"""
+
+        if value is None:
+            return False
+
+        when = epoch_millis(value)
+        checks = {"gte": lambda b: when >= b, "gt": lambda b: when > b, "lte": lambda b: when <= b,
+                  "lt": lambda b: when < b}
+
+        return all(check(epoch_millis(bounds[name])) for name, check in checks.items() if name in bounds)
+
+    def query_string(self, query):
+        """The first query_string in a query, however deeply it's nested"""
+
+        if isinstance(query, dict):
+            if "query_string" in query:
+                return query["query_string"].get("query")
+
+            query = list(query.values())
+
+        if isinstance(query, list):
+            return next((found for part in query for found in [self.query_string(part)] if found), None)
+
+        return None
+
+    def profile(self, query, total):
+        """Make up a plausible Profile API result for a query_string search, on two shards"""
+
+        user_query = self.query_string(query) or "*"
+        term_type = "WildcardQuery" if "*" in user_query.strip("*") or user_query.startswith("*") else "TermQuery"
+        shards = []
+
+        for shard in range(2):
+            child_nanos = 1000 * total * (50 if term_type == "WildcardQuery" else 1) + 1
+            child = {"type": term_type, "description": user_query, "time_in_nanos": child_nanos,
+                     "breakdown": {"next_doc": child_nanos // 2, "build_scorer": child_nanos // 3,
+                                   "create_weight": child_nanos // 6, "next_doc_count": total}}
+            shards.append({
+                "id": f"[node{shard}][{self.index}][{shard}]",
+                "searches": [{
+                    "query": [{"type": "BooleanQuery", "description": f"+({user_query})",
+                               "time_in_nanos": child_nanos + 5000, "breakdown": {"score": 5000},
+                               "children": [child]}],
+                    "rewrite_time": 2000,
+                    "collector": [{"name": "SimpleTopScoreDocCollector", "reason": "search_top_hits",
+                                   "time_in_nanos": 100 * total}]
+                }]
+            })
+
+        return {"shards": shards}
+
+    def columns(self, limit):
+        """The first limit documents as flat columns, with the ES|QL type of each"""
+
+        types = {}
+
+        def walk(properties, prefix):
+            for name, mapping in properties.items():
+                if "properties" in mapping:
+                    walk(mapping["properties"], prefix + name + ".")
+                else:
+                    types[prefix + name] = mapping["type"]
+
+        walk(self.properties, "")
+        columns = {name: [] for name in types}
+
+        for doc in self.docs[:limit]:
+            for name, values in columns.items():
+                value = doc.get(name)
+
+                if value is None:
+                    value = doc
+
+                    for part in name.split("."):
+                        value = value.get(part) if isinstance(value, dict) else None
+
+                values.append(value)
+
+        return columns, types
+
+    def esql(self, params, body):
+        """Answer an ES|QL query, in Arrow when format=arrow, and columnar JSON otherwise"""
+
+        limit = re.search(r"\|\s*limit\s+(\d+)", body.get("query", ""), re.IGNORECASE)
+        columns, types = self.columns(min(int(limit.group(1)) if limit else 1000, 10_000))
+
+        if params.get("format") == "arrow":
+            import pyarrow as pa
+
+            arrays = {name: pa.array([epoch_millis(value) for value in values], pa.timestamp("ms", tz="UTC"))
+                      if types[name] == "date" else pa.array(values) for name, values in columns.items()}
+            sink = pa.BufferOutputStream()
+            table = pa.table(arrays)
+
+            with pa.ipc.new_stream(sink, table.schema) as writer:
+                writer.write_table(table)
+
+            return ArrowPayload(sink.getvalue().to_pybytes())
+
+        return {"columns": [{"name": name, "type": types[name]} for name in columns],
+                "values": list(columns.values()) if body.get("columnar") else [list(row) for row in
+                                                                               zip(*columns.values())]}
+
+    def sql(self, params, body):
+        """Answer an SQL query, or the next page of one, fetch_size rows at a time"""
+
+        if "cursor" in body:
+            with self.lock:
+                columns, types, start, size = self.cursors.pop(body["cursor"])
+        else:
+            limit = re.search(r"\blimit\s+(\d+)", body.get("query", ""), re.IGNORECASE)
+            columns, types = self.columns(int(limit.group(1)) if limit else len(self.docs))
+            types = {name: "datetime" if es_type == "date" else es_type for name, es_type in types.items()}
+            start, size = 0, int(body.get("fetch_size", 1000))
+
+        page = {name: values[start:start + size] for name, values in columns.items()}
+        response = {"values": list(page.values()) if body.get("columnar") else [list(row) for row in
+                                                                                  zip(*page.values())]}
+
+        if "cursor" not in body:
+            response["columns"] = [{"name": name, "type": types[name]} for name in columns]
+
+        if start + size < len(next(iter(columns.values()), [])):
+            cursor = self.new_id("cursor")
+
+            with self.lock:
+                self.cursors[cursor] = (columns, types, start + size, size)
+
+            response["cursor"] = cursor
+
+        return response
+
+    def close_cursor(self, params, body):
+        with self.lock:
+            freed = self.cursors.pop(body.get("cursor"), None) is not None
+
+        return {"succeeded": freed}
+
+    def aggregations(self, positions, aggs):
+        """Run terms, date_histogram and composite buckets, and the metric aggregations, over some documents"""
+
+        results = {}
+
+        for name, agg in aggs.items():
+            kind = next(key for key in agg if key not in ("aggs", "aggregations"))
+            sub_aggs = agg.get("aggs") or agg.get("aggregations") or {}
+
+            if kind == "composite":
+                results[name] = self.composite(positions, agg[kind], sub_aggs)
+
+            elif kind in ("terms", "date_histogram"):
+                groups = self.group(positions, kind, agg[kind])
+                keys = list(groups)
+
+                if kind == "terms":
+                    keys.sort(key=lambda key: (-len(groups[key]), str(key)))
+                    keys = keys[:agg[kind].get("size", 10)]
+                else:
+                    keys.sort()
+
+                results[name] = {"buckets": [dict(self.bucket_key(kind, agg[kind], key), doc_count=len(groups[key]),
+                                                  **self.aggregations(groups[key], sub_aggs)) for key in keys]}
+
+                if kind == "terms":
+                    results[name].update(doc_count_error_upper_bound=0,
+                                         sum_other_doc_count=len(positions) - sum(len(groups[key]) for key in keys))
+            else:
+                results[name] = self.metric(positions, kind, agg[kind])
+
+        return results
+
+    def composite(self, positions, composite, sub_aggs):
+        """Page through every combination of the sources' keys, in key order, from the after key"""
+
+        sources = [(name, *next(iter(source.items()))) for entry in composite["sources"]
+                   for name, source in entry.items()]
+        groups = {}
+
+        for pos in positions:
+            keys = []
+
+            for name, kind, options in sources:
+                key = self.bucket_value(pos, kind, options)
+
+                if key is None:
+                    break
+
+                keys.append(key)
+            else:
+                groups.setdefault(tuple(keys), []).append(pos)
+
+        after = composite.get("after")
+        keys = sorted(groups)
+
+        if after:
+            after = tuple(epoch_millis(after[name]) if kind == "date_histogram" else after[name]
+                          for name, kind, _ in sources)
+            keys = [key for key in keys if key > after]
+
+        buckets = []
+
+        for key in keys[:composite.get("size", 10)]:
+            bucket_key = {}
+
+            # Date sources are epoch millis unless they were given a format
+            for (name, kind, options), value in zip(sources, key):
+                readable = self.bucket_key(kind, options, value)
+                bucket_key[name] = readable["key_as_string"] if "format" in options else readable["key"]
+
+            buckets.append(dict(key=bucket_key, doc_count=len(groups[key]),
+                                **self.aggregations(groups[key], sub_aggs)))
+
+        result = {"buckets": buckets}
+
+        if buckets:
+            result["after_key"] = buckets[-1]["key"]
+
+        return result
+
+    def group(self, positions, kind, options):
+        groups = {}
+
+        for pos in positions:
+            key = self.bucket_value(pos, kind, options)
+
+            if key is not None:
+                groups.setdefault(key, []).append(pos)
+
+        return groups
+
+    def bucket_value(self, pos, kind, options):
+        """The bucket a document falls in: its field's value, or the start of its interval in epoch millis"""
+
+        value = field_value(self.docs[pos], options["field"])
+
+        if value is None or kind == "terms":
+            return value
+
+        if "calendar_interval" in options:
+            return calendar_floor(epoch_millis(value), options["calendar_interval"])
+
+        interval = interval_millis(options["fixed_interval"])
+
+        return int(epoch_millis(value)) // interval * interval
+
+    def bucket_key(self, kind, options, key):
+        if kind == "terms":
+            return {"key": key}
+
+        when = datetime.fromtimestamp(key / 1000, tz=timezone.utc)
+
+        return {"key_as_string": when.strftime("%Y-%m-%dT%H:%M:%S.000Z"), "key": key}
+
+    def metric(self, positions, kind, options):
+        """A metric aggregation over the documents' values of a field"""
+
+        values = [value for value in (field_value(self.docs[pos], options["field"]) for pos in positions)
+                  if value is not None]
+
+        if kind == "value_count":
+            return {"value": len(values)}
+
+        if kind == "cardinality":
+            return {"value": len(set(values))}
+
+        numbers = [epoch_millis(value) if isinstance(value, str) else value for value in values]
+
+        if kind == "percentiles":
+            return {"values": {str(float(percent)): percentile(numbers, percent)
+                               for percent in options.get("percents", [1, 5, 25, 50, 75, 95, 99])}}
+
+        if kind == "sum":
+            return {"value": sum(numbers)}
+
+        if not numbers:
+            return {"value": None}
+
+        if kind == "avg":
+            return {"value": sum(numbers) / len(numbers)}
+
+        return {"value": min(numbers) if kind == "min" else max(numbers)}
+
+    def count(self, params, body):
+        return {"count": len(self.matching(query=body.get("query"))),
+                "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0}}
+
+    def hits(self, positions, body, started, sort, total=None):
+        source = body.get("_source", True)
+        hits = []
+
+        for pos in positions:
+            hit = {"_index": self.index, "_id": str(pos), "_score": 1.0}
+
+            if source is not False:
+                hit["_source"] = self.filter_source(self.docs[pos], source)
+
+            if sort:
+                hit["sort"] = self.sort_values(pos, body.get("sort") or ["_shard_doc"])
+
+            hits.append(hit)
+
+        response = {
+            "took": int((time.perf_counter() - started) * 1000),
+            "timed_out": False,
+            "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+            "hits": {"max_score": 1.0, "hits": hits}
+        }
+
+        track = body.get("track_total_hits", 10000)
+
+        if total is not None and track is not False:
+            limit = total if track is True else int(track)
+            response["hits"]["total"] = {"value": min(total, limit), "relation": "eq" if total <= limit else "gte"}
+
+        return response
+
+    def filter_source(self, doc, source):
+        """Apply _source includes to the top level of a document, which is all the benchmarks need"""
+
+        includes = source.get("includes") if isinstance(source, dict) else None
+
+        if not includes:
+            return doc
+
+        roots = {field.split(".")[0] for field in includes}
+
+        return {key: value for key, value in doc.items() if key in roots}
+
+
+class ArrowPayload(bytes):
+    """A response body that's already Arrow IPC stream bytes"""
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so connections are kept alive, like a real node
+    protocol_version = "HTTP/1.1"
+    cluster = None
+
+    def setup(self):
+        super().setup()
+        self.cluster.tally("connections")
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_POST(self):
+        self.dispatch("POST")
+
+    def do_DELETE(self):
+        self.dispatch("DELETE")
+
+    def do_HEAD(self):
+        self.dispatch("HEAD")
+
+    def dispatch(self, method):
+        url = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        parts = [part for part in url.path.split("/") if part]
+        raw = self.read_body()
+
+        if self.cluster.latency:
+            time.sleep(self.cluster.latency)
+
+        self.cluster.tally("requests")
+
+        try:
+            if parts[-1:] == ["_msearch"]:
+                self.respond(200, self.cluster.msearch(params, raw.decode("utf-8").splitlines()))
+                return
+
+            body = json.loads(raw) if raw else {}
+            response = self.route(method, parts)(params, body)
+
+            if params.get("filter_path") and not isinstance(response, ArrowPayload):
+                response = apply_filter_path(response, params["filter_path"].split(","))
+
+            self.respond(200, response)
+
+        except KeyError as e:
+            self.respond(404, {"error": {"type": "resource_not_found_exception", "reason": str(e)},
+                               "status": 404})
+
+    def route(self, method, parts):
+        if not parts:
+            return self.cluster.info
+
+        if parts[:2] == ["_cat", "indices"]:
+            return self.cluster.cat_indices
+
+        if parts == ["_pit"] and method == "DELETE":
+            return self.cluster.close_pit
+
+        if parts[-1] == "_count":
+            return self.cluster.count
+
+        if parts[-1] == "_mapping":
+            return self.cluster.mapping
+
+        if parts[-1] == "_pit":
+            return self.cluster.open_pit
+
+        if parts == ["_search", "scroll"]:
+            return self.cluster.clear_scroll if method == "DELETE" else self.cluster.scroll
+
+        if parts[-1] == "_search":
+            return self.cluster.search
+
+        if parts == ["_query"]:
+            return self.cluster.esql
+
+        if parts == ["_sql", "close"]:
+            return self.cluster.close_cursor
+
+        if parts == ["_sql"]:
+            return self.cluster.sql
+
+        raise KeyError(self.path)
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        self.cluster.tally("request_bytes", len(raw))
+
+        if self.headers.get("Content-Encoding") == "gzip":
+            raw = gzip.decompress(raw)
+
+        return raw
+
+    def respond(self, status, payload):
+        if isinstance(payload, ArrowPayload):
+            data = bytes(payload)
+            headers = {"Content-Type": "application/vnd.apache.arrow.stream", "X-Elastic-Product": "Elasticsearch"}
+        else:
+            data = json.dumps(payload).encode("utf-8")
+            headers = {"Content-Type": "application/json", "X-Elastic-Product": "Elasticsearch"}
+
+        if "gzip" in (self.headers.get("Accept-Encoding") or ""):
+            data = gzip.compress(data, compresslevel=1)
+            headers["Content-Encoding"] = "gzip"
+
+        self.cluster.tally("response_bytes", len(data))
+        self.send_response(status)
+
+        for name, value in headers.items():
+            self.send_header(name, value)
+
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
@@ -1,11 +1,22 @@
-import pandas as pd
+import inspect
+import time
+from threading import Lock
+from IPython.display import display, Markdown
 from IPython.core.magic import (magics_class, line_cell_magic)
 from integration_core import Integration
 import jupyter_integrations_utility as jiu
 from es_core._version import __desc__
 from es_utils.es_api import ElasticAPI
 from es_utils.user_input_parser import UserInputParser
-from es_utils.api_response_parser import ResponseParser
+from es_utils.api_response_parser import ResponseParser, ColumnBuilder, format_bytes
+from es_utils.background import BackgroundQuery, BackgroundRunner
+from es_utils.exporter import SearchExporter
+from es_utils.fan_out import FanOut, is_fan_out, match_instances, until_stopped
+from es_utils.incremental import IncrementalSearches
+from es_utils.query_stats import QueryStats, StatsHistory
+from es_utils.result_cache import ResultCache
+from es_utils.transport_options import TRANSPORT_OPTIONS
+from es_utils.typed_frame import apply_types
 
 
 @magics_class
@@ -14,11 +25,16 @@ class Es(Integration):
     # The name of the integration
     name_str = "es"
     instances = {}
-    custom_evars = ["es_conn_default", "es_max_results", "es_scroll_size", "es_scroll_time"]
+    custom_evars = ["es_conn_default", "es_max_results", "es_scroll_size", "es_scroll_time",
+                    "es_cache_max_bytes", "es_cache_ttl", "es_cache_dir", "es_stats_file",
+                    "es_index_cache_ttl", "es_instance_timeout", "es_score", "es_page_bytes", "es_max_bytes"]
 
     # These are the variables in the opts dict that allowed to be set by the user. These are specific
     # to this custom integration and are joined with the base_allowed_set_opts from the integration base
-    custom_allowed_set_opts = ["es_conn_default", "es_max_results", "es_scroll_size", "es_scroll_time"]
+    custom_allowed_set_opts = ["es_conn_default", "es_max_results", "es_scroll_size", "es_scroll_time",
+                               "es_cache_max_bytes", "es_cache_ttl", "es_cache_dir", "es_stats_file",
+                               "es_index_cache_ttl", "es_instance_timeout", "es_score", "es_page_bytes",
+                               "es_max_bytes"]
 
     myopts = {}
     myopts["es_conn_default"] = ["default", "Default instance to connect with"]
@@ -28,6 +44,26 @@ class Es(Integration):
     myopts["es_scroll_time"] = ["2m", "Specifies to the server how long to keep scrollable \
         results available while the client accepts and processes results. Only change this \
         if you're receiving errors."]
+    myopts["es_cache_max_bytes"] = [536870912, "Memory budget, in bytes, for cached search results. \
+        The least recently used results are evicted once it's exceeded."]
+    myopts["es_cache_ttl"] = [900, "How many seconds a cached search result stays valid."]
+    myopts["es_cache_dir"] = ["", "Directory to spill evicted search results to as Parquet files. \
+        Leave empty to drop evicted results instead."]
+    myopts["es_stats_file"] = ["", "File to append the timing stats of every query to, as JSON lines. \
+        Leave empty to only keep them in memory for `%es stats`."]
+    myopts["es_index_cache_ttl"] = [300, "How many seconds to cache each instance's list of indices \
+        (used by get_indices and tab completion) before refreshing it in the background."]
+    myopts["es_instance_timeout"] = [300, "When a query runs on several instances at once (e.g. -i us-*,eu-*), \
+        how many seconds to wait for each before leaving it out of the results."]
+    myopts["es_score"] = [True, "Whether searches score their hits. Set to False to make non-scoring searches \
+        (filter context, sorted on _doc, without counting every match) the default, which is cheaper for \
+        bulk pulls. --score and --no-score override it for one search."]
+    myopts["es_page_bytes"] = [8388608, "Target size, in bytes, of each page of a search. Pages start at \
+        es_scroll_size hits and are resized from the size of the hits so far, so small documents take fewer \
+        round trips and big ones stay under the cluster's response limits. Set to 0 to keep every page at \
+        es_scroll_size."]
+    myopts["es_max_bytes"] = [0, "Stop a search once its hits come to this many bytes (as JSON), as well as \
+        at es_max_results hits. Set to 0 for no limit."]
 
     def __init__(self, shell, debug=False, *args, **kwargs):
         super(Es, self).__init__(shell, debug=debug)
@@ -43,11 +79,35 @@ class Es(Integration):
         for k, v in self.myopts.items():
             self.search_opts[k] = v[0]
 
-        self.user_input_parser = UserInputParser()
+        # Built on first use, along with its argparse trees
+        self._user_input_parser = None
         self.response_parser = ResponseParser()
         self.load_env(self.custom_evars)
         self.parse_instances()
 
+        self.background = BackgroundRunner()
+        self.stats_history = StatsHistory()
+        # Tab complete index names after -d/--index from each instance's cached index catalog
+        self.shell.set_hook("complete_command", self.complete_index,
+                            re_key=r"^\s*(search|msearch|aggregate)\b.*\s(-d|--index)\s+\S*$")
+
+        self.result_cache = ResultCache(self.opts["es_cache_max_bytes"][0], self.opts["es_cache_ttl"][0],
+                                        self.opts["es_cache_dir"][0])
+        self.incremental = IncrementalSearches()
+
+    @property
+    def user_input_parser(self):
+        if self._user_input_parser is None:
+            self._user_input_parser = UserInputParser()
+
+        return self._user_input_parser
+
+    def make_dataframe(self, data):
+        """Build a DataFrame, importing pandas the first time we need one rather than at load"""
+        import pandas as pd
+
+        return pd.DataFrame(data)
+
     def customAuth(self, instance):
         result = -1
         inst = None
@@ -86,16 +146,105 @@ class Es(Integration):
         status = ""
 
         try:
+            self.refresh_search_opts()
+
             parsed_input = self.user_input_parser.parse_input(query, type="cell", **self.search_opts)
 
             if self.debug:
                 jiu.displayMD(f"**[ Dbg ]** parsed_input\n{parsed_input}")
 
-            response = self.instances[instance]["session"]._handler(**parsed_input["input"])
+            fan_out = is_fan_out(parsed_input["input"].get("instance"))
+
+            if fan_out:
+                self.check_fan_out(parsed_input["input"])
+
+                # Results from several instances are recorded and cached under the -i list or pattern
+                instance = parsed_input["input"]["instance"]
+
+            stats = QueryStats(instance, parsed_input["input"].get("command"), parsed_input["input"].get("index"),
+                               parsed_input["input"].get("query"))
+            parsed_input["input"]["stats"] = stats
+
+            if parsed_input["input"].get("out"):
+                exporter = SearchExporter(parsed_input["input"]["out"])
+                started = time.perf_counter()
+                summary = exporter.run(self.instances[instance]["session"], **parsed_input["input"])
+                stats.add_stage("parse", time.perf_counter() - started)
+                self.record_stats(stats, summary["rows"])
+
+                return self.make_dataframe([summary]), status
+
+            if parsed_input["input"].get("incremental"):
+                return self.incremental_search(instance, stats, parsed_input["input"]), status
+
+            if parsed_input["input"].get("sample") or parsed_input["input"].get("preview"):
+                return self.sample_search(instance, stats, parsed_input["input"]), status
+
+            cache_mode = parsed_input["input"].get("cache") or "use"
+            cache_key = None
+
+            # A profile needs the search to actually run
+            if parsed_input["input"].get("profile"):
+                cache_mode = "refresh" if cache_mode == "use" else cache_mode
+                parsed_input["input"]["profiles"] = []
+
+            # ES|QL and SQL results come with their column types, which --typed goes by
+            if parsed_input["input"].get("command") in ("esql", "sql"):
+                parsed_input["input"]["column_types"] = {}
 
-            parsed_response = self.response_parser._handler(response, **parsed_input["input"])
+            if cache_mode != "bypass":
+                self.update_result_cache()
+                cache_key = self.result_cache.make_key(**dict(parsed_input["input"], instance=instance))
 
-            dataframe = pd.DataFrame(parsed_response)
+                if cache_mode == "use":
+                    dataframe = self.result_cache.get(cache_key)
+
+            if dataframe is None:
+                if parsed_input["input"].get("background") is not None:
+                    name = parsed_input["input"]["background"] or self.background.next_name()
+                    self.run_background_search(name, instance, cache_key, parsed_input["input"])
+
+                    return None, f"Started background search {name}, its results will be stored in `{name}`"
+
+                if (parsed_input["input"].get("slices") or 1) > 1:
+                    parsed_input["input"]["progress"] = self.search_progress()
+
+                if fan_out:
+                    dataframe = self.fan_out_search(instance, stats, parsed_input["input"])
+
+                else:
+                    # Searches are streamed, so most of the requests happen while the response is parsed
+                    started = time.perf_counter()
+                    response = self.instances[instance]["session"]._handler(**parsed_input["input"])
+                    parsed_response = self.response_parser._handler(response, **parsed_input["input"])
+                    stats.add_stage("parse", time.perf_counter() - started)
+
+                    started = time.perf_counter()
+                    dataframe = self.make_dataframe(parsed_response)
+
+                    if parsed_input["input"].get("typed"):
+                        dataframe = self.type_dataframe(instance, dataframe, stats, parsed_input["input"])
+
+                    stats.add_stage("frame", time.perf_counter() - started)
+
+                if parsed_input["input"].get("profile"):
+                    self.show_profile(parsed_input["input"]["profile"], parsed_input["input"]["profiles"])
+
+                if stats.record["max_bytes_reached"]:
+                    jiu.displayMD(f"Stopped at **{len(dataframe)}** hits, which came to es_max_bytes \
+                        ({format_bytes(int(self.opts['es_max_bytes'][0]))}). Raise es_max_bytes (or set it to 0) \
+                        for the rest")
+
+                self.record_stats(stats, len(dataframe))
+
+                # Results missing an instance that failed or timed out are left uncached, so it's retried next run
+                partial = any(result["error"] for result in dataframe.attrs.get("instances", {}).values())
+
+                if cache_key is not None and not partial:
+                    self.result_cache.put(cache_key, dataframe, **dict(parsed_input["input"], instance=instance))
+
+            if parsed_input["input"].get("split"):
+                self.shell.user_ns[parsed_input["input"]["split"]] = self.split_queries(dataframe)
 
         except Exception as e:
             raise
@@ -104,6 +253,325 @@ class Es(Integration):
 
         return dataframe, status
 
+    def show_profile(self, name, profiles):
+        """Show a summary of a search's profile, and store its per-shard, per-clause timings in name"""
+
+        parsed_profile = self.response_parser.profile(profiles)
+        self.shell.user_ns[name] = self.make_dataframe(parsed_profile["columns"])
+        jiu.displayMD(parsed_profile["summary"] + f"\nThe timings of every clause on every shard are in `{name}`")
+
+    def check_fan_out(self, search_input):
+        """Refuse the options that only make sense on one instance at a time"""
+
+        single = {"out": "-o/--out", "incremental": "--incremental", "sample": "--sample",
+                  "preview": "--preview", "background": "-b/--background", "profile": "--profile"}
+        used = [flag for option, flag in single.items() if search_input.get(option) not in (None, False)]
+
+        if used:
+            raise ValueError(f"{', '.join(used)} can only be used with a single instance, not \
+                -i {search_input['instance']}")
+
+    def fan_out_search(self, pattern, stats, search_input):
+        """Run a query on every instance -i names at once, and merge the results with an instance column
+
+        Instances that aren't connected, fail, or take longer than es_instance_timeout are
+        left out of the results and reported, as long as at least one instance succeeds.
+        Each instance's rows, seconds and error are in the DataFrame's attrs["instances"].
+
+        Returns:
+            DataFrame: every instance's results, with the instance they came from
+        """
+
+        names = match_instances(pattern, self.instances)
+        sessions = {}
+        failures = {}
+
+        for name in names:
+            session = self.instances.get(name, {}).get("session")
+
+            if session is None:
+                failures[name] = "not connected" if name in self.instances else "no such instance"
+            else:
+                sessions[name] = session
+
+        search_input = dict(search_input, progress=None)
+
+        # Each instance is parsed on its own thread, which also makes its requests, so its parse
+        # time is recorded there
+        def query(name, session, stop):
+            started = time.perf_counter()
+            response = session._handler(**search_input)
+
+            if inspect.isgenerator(response):
+                response = until_stopped(response, stop)
+
+            parsed_response = self.response_parser._handler(response, **search_input)
+            stats.add_stage("parse", time.perf_counter() - started)
+
+            return self.make_dataframe(parsed_response)
+
+        frames, errors, elapsed = FanOut(sessions, float(self.opts["es_instance_timeout"][0])).run(query)
+        failures.update(errors)
+
+        if not frames:
+            reasons = "; ".join(f"{name}: {error}" for name, error in failures.items())
+            raise ValueError(f"The query failed on every instance: {reasons}" if reasons else
+                             f"No instances match {pattern}")
+
+        started = time.perf_counter()
+        dataframe = self.merge_instances(names, frames)
+
+        if search_input.get("typed"):
+            dataframe = self.type_dataframe(next(iter(frames)), dataframe, stats, search_input)
+
+        stats.add_stage("frame", time.perf_counter() - started)
+
+        dataframe.attrs["instances"] = {name: {"rows": len(frames[name]) if name in frames else 0,
+                                               "seconds": round(elapsed.get(name, 0.0), 3),
+                                               "error": failures.get(name)} for name in names}
+        summary = ", ".join(f"{name} {len(frames[name]):,} rows in {elapsed[name]:.2f}s" for name in names
+                            if name in frames)
+        jiu.displayMD(f"Searched **{len(frames)}** of {len(names)} instances: {summary}")
+
+        for name, error in failures.items():
+            jiu.display_error(f"Left {name} out of the results, so they won't be cached: {error}")
+
+        return dataframe
+
+    def merge_instances(self, names, frames):
+        """Stack each instance's results, in the order they were asked for, with an instance column
+
+        If the documents have their own instance field, the column is called _instance instead.
+        """
+
+        import pandas as pd
+
+        merged = []
+
+        for name in names:
+            if name in frames:
+                frame = frames[name]
+                frame.insert(0, "_instance" if "instance" in frame.columns else "instance", name)
+                merged.append(frame)
+
+        return pd.concat(merged, ignore_index=True, sort=False)
+
+    def incremental_search(self, instance, stats, search_input):
+        """Fetch only the documents newer than the last run of this search, and add them to its results
+
+        Returns:
+            DataFrame: every row this search has returned, within its --window if one was given
+        """
+
+        key = self.incremental.make_key(**dict(search_input, instance=instance))
+        tail = self.incremental.get(key, reset=search_input.get("cache") == "refresh")
+        # Slices would interleave their pages, so the search is fetched in one, oldest first
+        search_input = dict(search_input, since=tail.high_water, slices=1)
+
+        started = time.perf_counter()
+        pages = tail.track(self.instances[instance]["session"].search(**search_input))
+        parsed_response = self.response_parser.search(pages, **search_input)
+        stats.add_stage("parse", time.perf_counter() - started)
+
+        started = time.perf_counter()
+        new_rows = self.make_dataframe(parsed_response)
+        fetched = tail.pending["hits"]
+        dataframe = tail.append(new_rows, search_input.get("window"))
+
+        # Categories differ from run to run, so the appended frame is typed as a whole
+        if search_input.get("typed"):
+            dataframe = tail.frame = self.type_dataframe(instance, dataframe, stats, search_input)
+
+        stats.add_stage("frame", time.perf_counter() - started)
+        self.record_stats(stats, len(new_rows))
+
+        if fetched >= search_input["es_max_results"]:
+            jiu.display_error(f"This run stopped at es_max_results ({fetched}) documents, so there may be newer \
+                ones it hasn't fetched yet. Run it again to pick up from where it stopped")
+
+        return dataframe
+
+    def sample_search(self, instance, stats, search_input):
+        """Run a --sample or --preview search, and show how many documents the full search would return
+
+        Returns:
+            DataFrame: the sampled documents, with the total matches in its attrs
+        """
+
+        started = time.perf_counter()
+        response = self.instances[instance]["session"]._sample(**search_input)
+        builder = ColumnBuilder.for_search(**search_input)
+        builder.add_page(response["hits"])
+        columns = builder.finish()
+        stats.add_stage("parse", time.perf_counter() - started)
+
+        started = time.perf_counter()
+        dataframe = self.make_dataframe(columns)
+
+        if search_input.get("typed"):
+            dataframe = self.type_dataframe(instance, dataframe, stats, search_input)
+
+        dataframe.attrs["total"] = response["total"]
+        dataframe.attrs["total_relation"] = response["relation"]
+        stats.add_stage("frame", time.perf_counter() - started)
+        self.record_stats(stats, len(dataframe))
+
+        at_least = "at least " if response["relation"] == "gte" else ""
+        jiu.displayMD(f"Showing **{len(dataframe)}** of {at_least}**{response['total']:,}** matching documents")
+
+        return dataframe
+
+    def type_dataframe(self, instance, dataframe, stats, search_input, report=True):
+        """Give a DataFrame's columns dtypes from its index mapping (--typed), and report the memory saved
+
+        ES|QL and SQL results go by the column types the cluster sent with them instead.
+
+        Args:
+            report (bool): show the before and after memory in the cell's output, as well as in the stats
+
+        Returns:
+            DataFrame: the typed DataFrame
+        """
+
+        field_types = search_input.get("column_types")
+
+        if field_types is None:
+            field_types = self.instances[instance]["session"]._field_types(search_input["index"])
+        untyped_bytes = int(dataframe.memory_usage(deep=True).sum())
+        dataframe = apply_types(dataframe, field_types)
+        typed_bytes = int(dataframe.memory_usage(deep=True).sum())
+        stats.add_memory(untyped_bytes, typed_bytes)
+
+        if report:
+            jiu.displayMD(f"Typed DataFrame memory: **{format_bytes(untyped_bytes)}** untyped, \
+                **{format_bytes(typed_bytes)}** typed")
+
+        return dataframe
+
+    def refresh_search_opts(self):
+        """Pick up anything changed with `%es set` since we were loaded"""
+        for k in self.myopts.keys():
+            self.search_opts[k] = self.opts[k][0]
+
+    def complete_index(self, ipython, event):
+        """IPython completer for the -d/--index argument, served from the cached index catalog
+
+        It never waits on the cluster: until an instance's catalog has been fetched (which
+        this kicks off in the background) there's nothing to complete.
+        """
+
+        words = event.line.split()
+        instance = self.opts["es_conn_default"][0]
+
+        if "-i" in words[:-1] or "--instance" in words[:-1]:
+            flag = "-i" if "-i" in words[:-1] else "--instance"
+            instance = words[words.index(flag) + 1]
+
+        session = self.instances.get(instance, {}).get("session")
+
+        if session is None:
+            return []
+
+        prefix = "" if event.line.endswith((" ", "\t")) else event.symbol
+
+        return [idx["index"] for idx in session.index_catalog.cached() if idx["index"].startswith(prefix)]
+
+    def split_queries(self, dataframe):
+        """Split msearch results into one DataFrame per query, keyed on the query's label"""
+
+        if "_query" not in dataframe.columns:
+            return {}
+
+        return {label: frame.drop(columns="_query").dropna(axis=1, how="all").reset_index(drop=True)
+                for label, frame in dataframe.groupby("_query", sort=False)}
+
+    def record_stats(self, stats, hits):
+        """Finish a query's stats and add them to the history (and the stats file, if one is set)"""
+        self.stats_history.export_path = self.opts["es_stats_file"][0] or None
+        self.stats_history.add(stats.finish(hits))
+
+    def update_result_cache(self):
+        """Apply the current cache options, which may have changed with `%es set`"""
+        self.result_cache.max_bytes = int(self.opts["es_cache_max_bytes"][0])
+        self.result_cache.ttl = int(self.opts["es_cache_ttl"][0])
+        self.result_cache.spill_dir = self.opts["es_cache_dir"][0] or None
+
+    def run_background_search(self, name, instance, cache_key, parsed_input):
+        """Start a search on the background runner, with a live progress line in the cell's output
+
+        When it finishes, the DataFrame is stored in the user's namespace under name,
+        and in the result cache if it's being used.
+        """
+
+        handle = display(Markdown(f"**{name}:** starting"), display_id=True)
+        query = BackgroundQuery(name, on_update=lambda q: handle.update(Markdown(q.describe())))
+        session = self.instances[instance]["session"]
+
+        async def search():
+            builder = ColumnBuilder.for_search(**parsed_input)
+            pages = session._search_async(**dict(parsed_input, progress=query.progress))
+            stats = parsed_input["stats"]
+            started = time.perf_counter()
+
+            try:
+                async for page in pages:
+                    builder.add_page(page)
+
+            finally:
+                await pages.aclose()
+
+            stats.add_stage("parse", time.perf_counter() - started)
+            started = time.perf_counter()
+            dataframe = self.make_dataframe(builder.finish())
+
+            if parsed_input.get("typed"):
+                dataframe = self.type_dataframe(instance, dataframe, stats, parsed_input, report=False)
+
+            stats.add_stage("frame", time.perf_counter() - started)
+            self.record_stats(stats, len(dataframe))
+            self.shell.user_ns[name] = dataframe
+
+            if cache_key is not None:
+                self.result_cache.put(cache_key, dataframe, **dict(parsed_input, instance=instance))
+
+            return dataframe
+
+        return self.background.submit(query, search())
+
+    def search_progress(self):
+        """Build a callback that keeps one progress line per search slice in the cell's output"""
+        handles = {}
+        lock = Lock()
+
+        def report(slice_id, pages, hits, response_bytes=0):
+            status = Markdown(f"**Slice {slice_id}:** {pages} pages, {hits} hits, {response_bytes} bytes")
+            with lock:
+                if slice_id in handles:
+                    handles[slice_id].update(status)
+                else:
+                    handles[slice_id] = display(status, display_id=True)
+
+        return report
+
+    def background_command(self, action, name):
+        """Handle the `background` line magic"""
+
+        if action == "list":
+            jiu.displayMD(self.background.describe())
+
+        elif name not in self.background.queries:
+            jiu.display_error(f"No background search called **{name}**. Try `%es background`")
+
+        elif action == "await":
+            self.background.wait(name)
+            jiu.displayMD(self.background.queries[name].describe())
+
+        elif action == "cancel":
+            if self.background.cancel(name):
+                jiu.displayMD(f"Cancelling **{name}**")
+            else:
+                jiu.displayMD(self.background.queries[name].describe())
+
     def retCustomDesc(self):
         return __desc__
 
@@ -134,7 +602,66 @@ class Es(Integration):
                             "| %%es instance<br>command --help | Display the help syntax for a command below |\n"
                             "| %%es instance<br>search -i instance -d index<br>field1: (hello OR goodbye) \
                                 AND datetime: now-7d/d | Perform a query using Elasticsearch's **Query String \
-                                Query** syntax. https://www.elastic.co/guide/en/elasticsearch/reference/current/query-dsl-query-string-query.html |\n")
+                                Query** syntax. https://www.elastic.co/guide/en/elasticsearch/reference/current/query-dsl-query-string-query.html |\n"
+                            "| %%es instance<br>search -i instance -d index -p scroll<br>field1: hello | Page through \
+                                results with the scroll API instead of a point in time (for older clusters) |\n"
+                            "| %%es instance<br>search -i instance -d index -s 4<br>field1: hello | Split the search \
+                                into 4 slices and retrieve them concurrently |\n"
+                            "| %%es instance<br>search -i instance -d index -m<br>field1: hello | Keep each \
+                                hit's `_id` and `_index` as columns in the results |\n"
+                            "| %%es instance<br>search -i instance -d index -f host.name,event.action<br>field1: hello \
+                                | Only return these fields, as columns in this order. Use `-x` to exclude fields and \
+                                `-r fields` or `-r docvalues` to read them without `_source` |\n"
+                            "| %%es instance<br>search -i instance -d index -b results<br>field1: hello | Run the \
+                                search in the background and store the results in a variable called `results` |\n"
+                            "| %%es instance<br>aggregate -i instance -d index -g terms:host.name -g \
+                                date_histogram:@timestamp:1h -m cardinality:user.name<br>event.action: login | Count \
+                                hits per host per hour, and distinct users in each, on the server. Add `--composite` \
+                                to page through every bucket of high cardinality fields |\n"
+                            "| %%es instance<br>search -i instance -d index -o incident.parquet<br>field1: hello | \
+                                Stream every hit to disk (`.parquet` or `.ndjson`) and return a summary. Read it back \
+                                lazily with `pyarrow.dataset.dataset('incident.parquet')`. Re-run the cell to resume \
+                                an interrupted export |\n"
+                            "| %%es instance<br>msearch -i instance -d index<br>host.name: web01<br>@other-index \
+                                user.name: bob | Run several queries, one per line, in a single `_msearch` request. \
+                                A line starting with `@index` searches that index instead. Results are labelled \
+                                q1, q2, ... in a `_query` column, add `--split name` for a dict of DataFrames |\n"
+                            "| %%es instance<br>search -i instance -d index -c refresh<br>field1: hello | Re-run the \
+                                search even if its results are cached (`-c bypass` skips the cache entirely) |\n"
+                            "| %%es instance<br>search -i instance -d index --incremental --window 24h<br>field1: \
+                                hello | Only fetch documents newer than the last run (by `@timestamp`, or \
+                                `--time-field`) and append them to its results, dropping rows more than 24 hours \
+                                older than the newest. `-c refresh` starts over |\n"
+                            "| %%es instance<br>search -i instance -d index -t<br>field1: hello | Pick each \
+                                column's dtype from the index mapping: datetimes, categoricals for repetitive \
+                                keywords, downcast numbers and Arrow strings. The memory saved is shown after \
+                                the query |\n"
+                            "| %%es instance<br>search -i instance -d index --sample 500<br>field1: hello | \
+                                Return 500 random matching documents in one request, and the exact number of \
+                                matches. `--seed` makes the sample repeatable |\n"
+                            "| %%es instance<br>search -i instance -d index --preview<br>field1: hello | \
+                                Return the first 100 (or `--preview N`) matching documents in one request, and \
+                                roughly how many match, to see whether the full search is worth running |\n"
+                            "| %%es instance<br>search -i us-*,eu-west -d index<br>field1: hello | Run a search, \
+                                msearch or aggregate on several instances at once and merge the results, with an \
+                                `instance` column. Instances that fail or take longer than `es_instance_timeout` \
+                                are reported and left out |\n"
+                            "| %%es instance<br>search -i instance -d index --profile<br>message: \\*error | \
+                                Profile the search's first page on the cluster, and show its most expensive \
+                                clauses and shards, with advice on things like leading wildcards. Every clause's \
+                                timings on every shard are stored in `es_profile` (or `--profile NAME`) |\n"
+                            "| %%es instance<br>search -i instance -d index --from now-24h --to now --no-score<br>\
+                                field1: hello | Only match the last 24 hours of `@timestamp` (or `--time-field`), as \
+                                a range filter so shards outside it are skipped, and don't score the hits. Set \
+                                `es_score` to False to make `--no-score` the default |\n"
+                            "| %%es instance<br>esql -i instance<br>FROM logs-\\*<br>\\| WHERE event.action == \
+                                \"login\"<br>\\| STATS logins = COUNT(\\*) BY host.name | Run an ES\\|QL query, \
+                                over as many lines as you like. Results come back as Apache Arrow columns (or \
+                                columnar JSON without pyarrow). Without a `LIMIT`, the query gets one of \
+                                `es_max_results` |\n"
+                            "| %%es instance<br>sql -i instance<br>SELECT host.name, bytes FROM \"logs-\\*\" \
+                                WHERE bytes > 1000 | Run an SQL query, paging through the results a column at a \
+                                time with a cursor, up to `es_max_results` rows |\n")
 
         line_magic_helper_text = (f"\n## Running {magic_name} line magics\n"
                                   "-------------------------------\n"
@@ -147,9 +674,32 @@ class Es(Integration):
                             "| %es --help | Display usage syntax help for `%es` line magics |\n"
                             "| %es command --help | Display usage syntax help for a command below |\n"
                             "| %es instance<br>get_indices | Retrieve a list of indices from the \
-                                Elasticsearch cluster |\n")
-
-        help_out = cell_magic_helper_text + cell_magic_table + line_magic_helper_text + line_magic_table
+                                Elasticsearch cluster |\n"
+                            "| %es instance<br>get_indices -i instance -p logs- -s size -n 20 | List the 20 largest \
+                                indices starting with `logs-`, from the cached index catalog (`-r` to refresh it) |\n"
+                            "| %es cache | Show what's in the search result cache |\n"
+                            "| %es cache clear | Empty the search result cache, in memory and on disk, and \
+                                forget what incremental searches have returned |\n"
+                            "| %es stats | Show the timing breakdown of recent queries for each instance. Set \
+                                `es_stats_file` to also append them to a JSON lines file |\n"
+                            "| %es stats -i instance | Only show the query stats for one instance |\n"
+                            "| %es stats clear | Forget the query stats recorded so far |\n"
+                            "| %es background | List the searches running in the background |\n"
+                            "| %es background await name | Wait for a background search to finish |\n"
+                            "| %es background cancel name | Cancel a background search |\n")
+
+        transport_helper_text = ("\n## Connection options\n"
+                                 "---------------------\n"
+                                 "\n#### Add these to an instance's connection options to tune how it talks to \
+                                     the cluster, e.g. `pool_size=20&compress=true`\n")
+
+        transport_table = ("| Option | Default | Description |\n"
+                           "| ------ | ------- | ----------- |\n"
+                           + "".join(f"| {name} | {default} | {' '.join(description.split())} |\n"
+                                     for name, (_, default, description) in TRANSPORT_OPTIONS.items()))
+
+        help_out = cell_magic_helper_text + cell_magic_table + line_magic_helper_text + line_magic_table \
+            + transport_helper_text + transport_table
 
         return help_out
 
@@ -168,7 +718,8 @@ class Es(Integration):
             if not line_handled:  # We based on this we can do custom things for integrations.
 
                 try:
-                    parsed_input = self.user_input_parser.parse_input(line, type="line")
+                    self.refresh_search_opts()
+                    parsed_input = self.user_input_parser.parse_input(line, type="line", **self.search_opts)
 
                     if self.debug:
                         jiu.displayMD(f"**[ Dbg ]** Parsed Query: `{parsed_input}`")
@@ -176,6 +727,26 @@ class Es(Integration):
                     if parsed_input["error"] is True:
                         jiu.display_error(f"{parsed_input['message']}")
 
+                    elif parsed_input["input"]["command"] == "cache":
+                        self.update_result_cache()
+
+                        if parsed_input["input"]["action"] == "clear":
+                            removed = self.result_cache.clear()
+                            self.incremental.clear()
+                            jiu.displayMD(f"Removed **{removed}** cached results")
+                        else:
+                            jiu.displayMD(self.result_cache.describe())
+
+                    elif parsed_input["input"]["command"] == "stats":
+                        if parsed_input["input"]["action"] == "clear":
+                            self.stats_history.clear()
+                            jiu.displayMD("Cleared the query stats")
+                        else:
+                            jiu.displayMD(self.stats_history.describe(parsed_input["input"]["instance"]))
+
+                    elif parsed_input["input"]["command"] == "background":
+                        self.background_command(parsed_input["input"]["action"], parsed_input["input"]["name"])
+
                     else:
                         instance = parsed_input["input"]["instance"]
 
@@ -1,5 +1,147 @@
+import re
+import time
+from contextlib import closing
+from fnmatch import fnmatchcase
+
+
+def format_bytes(size):
+    """Format a byte count for people, e.g. 1536 -> "1.5kb" """
+
+    for unit in ("b", "kb", "mb", "gb", "tb"):
+        if size < 1024 or unit == "tb":
+            return f"{size:.1f}{unit}" if unit != "b" else f"{size}b"
+
+        size /= 1024
+
+
+class ColumnBuilder:
+    """Incrementally builds DataFrame columns from pages of search hits
+
+    Nested objects in each hit's _source are flattened into dotted column names
+    (e.g. {"host": {"name": "a"}} becomes "host.name"), and each column is a plain
+    list, padded with None for the hits that don't have that field. Pages can be
+    dropped as soon as they've been added. If fields are given, only columns matching
+    them are kept, in the order they were asked for.
+    """
+
+    def __init__(self, metadata=None, fields=None):
+        self.metadata = metadata or []
+        self.fields = fields or []
+        self.columns = {}
+        self.skipped = {}
+        self.rows = 0
+
+        for field in self.metadata:
+            self.columns[field] = []
+
+    @classmethod
+    def for_search(cls, **kwargs):
+        """Set up a builder for the user's parsed search input
+
+        If "metadata" is set, each hit's _id and _index are kept as the first columns,
+        and if "fields" is set only those columns are built, in that order.
+        """
+
+        return cls(["_id", "_index"] if kwargs.get("metadata") else None, kwargs.get("fields"))
+
+    def add_page(self, hits):
+        """Append every hit in a page to the columns"""
+
+        for hit in hits:
+            for field in self.metadata:
+                self.columns[field].append(hit.get(field))
+
+            self._add_fields(hit.get("_source") or {}, "")
+
+            # Values from the fields API and docvalue_fields always come back as arrays
+            for name, values in hit.get("fields", {}).items():
+                self._add_value(name, values[0] if len(values) == 1 else values)
+
+            self.rows += 1
+
+    def _add_fields(self, source, prefix):
+        for key, value in source.items():
+            name = prefix + key
+
+            if isinstance(value, dict):
+                self._add_fields(value, name + ".")
+            else:
+                self._add_value(name, value)
+
+    def _add_value(self, name, value):
+        column = self.columns.get(name)
+
+        if column is None:
+            if self.fields and not self._wanted(name):
+                return
+
+            column = self.columns[name] = []
+
+        # Catch up on the rows that didn't have this field
+        if len(column) < self.rows:
+            column.extend([None] * (self.rows - len(column)))
+
+        # This hit already filled the column (e.g. a literal "a.b" key and {"a": {"b": ...}}),
+        # so keep both values in one list, as the fields API would, instead of shifting the rows after it
+        elif len(column) > self.rows:
+            previous = column[-1] if isinstance(column[-1], list) else [column[-1]]
+            column[-1] = previous + (value if isinstance(value, list) else [value])
+
+            return
+
+        column.append(value)
+
+    def _wanted(self, name):
+        """Check whether a column matches any of the requested fields, remembering the answer"""
+
+        if name not in self.skipped:
+            self.skipped[name] = not any(self._matches(name, pattern) for pattern in self.fields)
+
+        return not self.skipped[name]
+
+    def _matches(self, name, pattern):
+        # "host" should also pick up the flattened "host.name", "host.ip", etc.
+        return fnmatchcase(name, pattern) or name.startswith(pattern + ".")
+
+    def finish(self):
+        """Pad every column out to the full row count and hand them back"""
+
+        for column in self.columns.values():
+            if len(column) < self.rows:
+                column.extend([None] * (self.rows - len(column)))
+
+        if not self.fields:
+            return self.columns
+
+        ordered = {field: self.columns[field] for field in self.metadata}
+
+        for pattern in self.fields:
+            for name, column in self.columns.items():
+                if name not in ordered and self._matches(name, pattern):
+                    ordered[name] = column
+
+        return ordered
+
+
 class ResponseParser:
 
+    # Lucene queries that have to walk a field's whole term dictionary, and what to do instead
+    expensive_queries = {
+        "RegexpQuery": ("regular expressions are checked against every term in the field. Anchor the "
+                        "expression with a literal prefix, or match on a keyword field instead"),
+        "FuzzyQuery": "fuzzy matching expands to many terms. Lower the edit distance or require a prefix",
+        "WildcardQuery": "wildcards are checked against every term in the field"
+    }
+
+    # Column types from SQL that go by another name in a mapping
+    sql_types = {"datetime": "date"}
+
+    # Clauses that only combine others, whose cost is really their children's
+    compound_queries = {"BooleanQuery", "ConstantScoreQuery", "DisjunctionMaxQuery", "FunctionScoreQuery"}
+
+    # A term starting with a wildcard, like message:*error
+    leading_wildcard = re.compile(r"(^|[\s(:])[*?][^\s)]")
+
     def __init__(self):
         pass
 
@@ -19,19 +161,311 @@ class ResponseParser:
         return getattr(self, issued_command)(response, **kwargs)
 
     def get_indices(self, response, **kwargs):
-        """Sort the indexes and format them as Markdown"""
+        """Format the indexes, in the order we got them, as a Markdown table"""
         instance = kwargs.get("instance")
-        response.sort()
-        formatted_index_names = "".join(f"* {idx}\n" for idx in response if not idx.startswith("."))
+        formatted_index_rows = "".join(
+            f"| {idx['index']} | {idx['health']} | {idx['docs']:,} | {format_bytes(idx['store_bytes'])} "
+            f"| {time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(idx['created'] / 1000))} |\n"
+            for idx in response
+        )
         formatted_index_list = (f"#### Indices in `{instance}`\n"
                                 "***\n"
-                                f"{formatted_index_names}")
+                                "| Index | Health | Docs | Size | Created (UTC) |\n"
+                                "| ----- | ------ | ---- | ---- | ------------- |\n"
+                                f"{formatted_index_rows}")
 
         return formatted_index_list
 
     def search(self, response, **kwargs):
-        """Turn the API response into a list of hits for our dataframe"""
+        """Turn the pages of hits from the API into columns for our dataframe
+
+        Args:
+            response (iterable): pages of hits, as yielded by ElasticAPI.search
+            kwargs (dict): the user's parsed input, see ColumnBuilder.for_search
+
+        Returns:
+            dict: column name -> list of values, all the same length
+        """
+
+        builder = ColumnBuilder.for_search(**kwargs)
+
+        # Closing the generator releases the point in time or scroll, even if we fail part way
+        with closing(response) as pages:
+            for page in pages:
+                builder.add_page(page)
+
+        return builder.finish()
+
+    def msearch(self, response, **kwargs):
+        """Turn the results of several queries into columns for one dataframe
+
+        Every row gets a _query column with its query's label (q1, q2, ...), and a query that
+        failed gets a single row with its error in an _error column.
+
+        Returns:
+            dict: column name -> list of values, all the same length
+        """
+
+        metadata = ["_query"] + (["_id", "_index"] if kwargs.get("metadata") else [])
+
+        if any(result["error"] is not None for result in response.values()):
+            metadata.append("_error")
+
+        builder = ColumnBuilder(metadata, kwargs.get("fields"))
+
+        for label, result in response.items():
+            if result["error"] is not None:
+                builder.add_page([{"_query": label, "_error": result["error"]}])
+                continue
+
+            for page in result["pages"]:
+                for hit in page:
+                    hit["_query"] = label
+
+                builder.add_page(page)
+
+        return builder.finish()
+
+    def aggregate(self, response, **kwargs):
+        """Flatten an aggregation's buckets into columns for our dataframe
+
+        There's one row per innermost bucket (or composite bucket), with a column for each
+        group by field, the bucket's doc_count, and a column for each metric. Percentiles get
+        a column per percent. With no group by there's a single row for the whole query.
+
+        Returns:
+            dict: column name -> list of values, all the same length
+        """
+
+        group_by = kwargs.get("group_by") or []
+        metrics = kwargs.get("metric") or []
+        rows = []
+
+        if "buckets" in response:
+            for bucket in response["buckets"]:
+                row = {group["field"]: bucket["key"][f"group_{depth}"] for depth, group in enumerate(group_by)}
+                rows.append(self._bucket_row(row, bucket, metrics))
+
+        elif group_by:
+            self._walk_buckets(response["aggregations"], group_by, metrics, 0, {}, rows)
+
+        else:
+            rows.append(self._bucket_row({}, dict(response["aggregations"], doc_count=response.get("total")), metrics))
+
+        builder = ColumnBuilder()
+        builder.add_page({"_source": row} for row in rows)
+
+        return builder.finish()
+
+    def _walk_buckets(self, aggregations, group_by, metrics, depth, row, rows):
+        """Depth first walk of nested buckets, adding a row for every innermost bucket"""
+
+        for bucket in aggregations[f"group_{depth}"]["buckets"]:
+            bucket_row = dict(row)
+            bucket_row[group_by[depth]["field"]] = bucket.get("key_as_string", bucket["key"])
+
+            if depth + 1 < len(group_by):
+                self._walk_buckets(bucket, group_by, metrics, depth + 1, bucket_row, rows)
+            else:
+                rows.append(self._bucket_row(bucket_row, bucket, metrics))
+
+    def _bucket_row(self, row, bucket, metrics):
+        """Add a bucket's doc_count and metric values to a row"""
+
+        row["doc_count"] = bucket["doc_count"]
+
+        for position, metric in enumerate(metrics):
+            result = bucket[f"metric_{position}"]
+
+            if metric["type"] == "percentiles":
+                for percent, value in result["values"].items():
+                    row[f"{metric['field']} p{float(percent):g}"] = value
+            else:
+                row[f"{metric['type']}({metric['field']})"] = result["value"]
+
+        return row
+
+    def esql(self, response, **kwargs):
+        """Turn ES|QL results into a DataFrame
+
+        An Arrow table becomes Arrow-backed columns that share its buffers, so no value is
+        ever turned into a Python object. Columnar JSON is used a column at a time. The
+        Elasticsearch type of each column is recorded in the caller's "column_types", if
+        it passed one, for --typed.
+
+        Args:
+            response (iterable): pages of results, as yielded by ElasticAPI.esql or sql
+
+        Returns:
+            DataFrame: the results
+        """
+
+        import pandas as pd
+
+        column_types = kwargs.get("column_types")
+        column_types = {} if column_types is None else column_types
+        tables = []
+        columns = {}
+
+        with closing(response) as pages:
+            for page in pages:
+                if "table" in page:
+                    tables.append(page["table"])
+                    continue
+
+                for column, values in zip(page["columns"], page["values"]):
+                    columns.setdefault(column["name"], []).extend(values)
+                    column_types[column["name"]] = self.sql_types.get(column["type"], column["type"])
+
+        if not tables:
+            return pd.DataFrame(columns)
+
+        import pyarrow as pa
+
+        table = pa.concat_tables(tables)
+
+        for field in table.schema:
+            if pa.types.is_string(field.type) or pa.types.is_large_string(field.type):
+                column_types[field.name] = "keyword"
+
+        return table.to_pandas(types_mapper=pd.ArrowDtype)
+
+    def sql(self, response, **kwargs):
+        """Turn SQL results into a DataFrame, see esql"""
+
+        return self.esql(response, **kwargs)
+
+    def profile(self, response, **kwargs):
+        """Break down the Profile API's results into per-shard, per-clause timings
+
+        Args:
+            response (list): the "profile" section of each profiled response, see ElasticAPI.search
+
+        Returns:
+            dict: "columns", one row per query clause on each shard (column name -> list of values),
+                and "summary", Markdown listing the most expensive clauses and shards, with advice
+                for clauses like leading wildcards and regular expressions
+        """
+
+        rows = []
+        shards = []
+
+        for profile in response:
+            for shard in profile.get("shards", []):
+                shard_name = self._shard_name(shard)
+                query_ms = rewrite_ms = collect_ms = 0.0
+
+                for search in shard.get("searches", []):
+                    for clause in search.get("query", []):
+                        query_ms += clause["time_in_nanos"] / 1e6
+                        self._walk_clauses(clause, shard_name, 0, clause["time_in_nanos"], rows)
+
+                    rewrite_ms += search.get("rewrite_time", 0) / 1e6
+                    collect_ms += sum(collector["time_in_nanos"] for collector in search.get("collector", [])) / 1e6
+
+                shards.append({"shard": shard_name, "query_ms": query_ms, "rewrite_ms": rewrite_ms,
+                               "collect_ms": collect_ms})
+
+        builder = ColumnBuilder()
+        builder.add_page({"_source": row} for row in rows)
+
+        return {"columns": builder.finish(), "summary": self._profile_summary(rows, shards)}
+
+    def _shard_name(self, shard):
+        """Name a shard "index[number]", from its own fields or its "[node][index][shard]" id"""
+
+        if "index" in shard and "shard_id" in shard:
+            return f"{shard['index']}[{shard['shard_id']}]"
+
+        parts = re.findall(r"\[([^\]]*)\]", shard.get("id", ""))
+
+        return f"{parts[1]}[{parts[2]}]" if len(parts) == 3 else shard.get("id", "")
+
+    def _walk_clauses(self, clause, shard_name, depth, shard_nanos, rows):
+        """Depth first walk of a shard's query tree, adding a row for every clause"""
+
+        steps = {step: nanos for step, nanos in clause.get("breakdown", {}).items() if not step.endswith("_count")}
+        slowest_step = max(steps, key=steps.get) if steps else None
+
+        rows.append({
+            "shard": shard_name,
+            "depth": depth,
+            "type": clause["type"],
+            "description": clause["description"],
+            "time_ms": clause["time_in_nanos"] / 1e6,
+            "percent": 100 * clause["time_in_nanos"] / shard_nanos if shard_nanos else 0.0,
+            "slowest_step": slowest_step,
+            "slowest_step_ms": steps[slowest_step] / 1e6 if slowest_step else None
+        })
+
+        for child in clause.get("children", []):
+            self._walk_clauses(child, shard_name, depth + 1, shard_nanos, rows)
+
+    def _profile_summary(self, rows, shards):
+        """Summarize a profile as Markdown: the slowest clauses (summed over shards), shards, and advice"""
+
+        if not shards:
+            return "The cluster didn't return a profile for this search"
+
+        clauses = {}
+
+        for row in rows:
+            clause = clauses.setdefault((row["type"], row["description"]), {"time_ms": 0.0, "shards": 0,
+                                                                             "steps": {}})
+            clause["time_ms"] += row["time_ms"]
+            clause["shards"] += 1
+
+            if row["slowest_step"]:
+                clause["steps"][row["slowest_step"]] = clause["steps"].get(row["slowest_step"], 0) + 1
+
+        slowest_clauses = sorted(clauses.items(), key=lambda item: item[1]["time_ms"], reverse=True)[:5]
+        slowest_shards = sorted(shards, key=lambda shard: shard["query_ms"] + shard["collect_ms"], reverse=True)[:3]
+        total_ms = sum(shard["query_ms"] + shard["rewrite_ms"] + shard["collect_ms"] for shard in shards)
+
+        clause_rows = "".join(
+            f"| `{self._shorten(description)}` | {clause_type} | {clause['time_ms']:.2f} | {clause['shards']} "
+            f"| {max(clause['steps'], key=clause['steps'].get) if clause['steps'] else ''} |\n"
+            for (clause_type, description), clause in slowest_clauses
+        )
+        shard_rows = "".join(
+            f"| {shard['shard']} | {shard['query_ms']:.2f} | {shard['rewrite_ms']:.2f} | {shard['collect_ms']:.2f} |\n"
+            for shard in slowest_shards
+        )
+
+        advice = "".join(f"* `{self._shorten(description)}`: {reason}\n"
+                         for (clause_type, description) in clauses
+                         for reason in [self._clause_advice(clause_type, description)] if reason)
+
+        return ("#### Search profile\n"
+                "***\n"
+                f"Profiled the first page on **{len(shards)}** shards, "
+                f"**{total_ms:.2f} ms** of search time in total\n\n"
+                "| Clause | Type | Time (ms) | Shards | Slowest step |\n"
+                "| ------ | ---- | --------- | ------ | ------------ |\n"
+                f"{clause_rows}\n"
+                "| Shard | Query (ms) | Rewrite (ms) | Collect (ms) |\n"
+                "| ----- | ---------- | ------------ | ------------ |\n"
+                f"{shard_rows}\n"
+                + (f"**Worth fixing before running this against production**\n\n{advice}" if advice else ""))
+
+    def _clause_advice(self, clause_type, description):
+        """Explain why a clause is expensive, or return None if it isn't one we know about"""
+
+        if clause_type in self.compound_queries:
+            return None
+
+        if self.leading_wildcard.search(description):
+            return ("starts with a wildcard, so every term in the field has to be checked. Anchor it with a "
+                    "literal prefix, or search a field indexed for it (e.g. the wildcard field type)")
+
+        reason = self.expensive_queries.get(clause_type)
+
+        if reason is None and ":/" in description:
+            reason = self.expensive_queries["RegexpQuery"]
+
+        return reason
 
-        data = [hit["_source"] for hit in response]
+    def _shorten(self, description, length=80):
+        description = " ".join(description.split()).replace("|", "\\|").replace("`", "'")
 
-        return data
+        return description if len(description) <= length else description[:length - 3] + "..."
@@ -0,0 +1,144 @@
+import asyncio
+import time
+from itertools import count
+from threading import Thread
+
+
+class BackgroundQuery:
+    """A search running in the background, and the progress it's made so far"""
+
+    def __init__(self, name, on_update=None):
+        self.name = name
+        self.on_update = on_update
+        self.status = "running"
+        self.pages = 0
+        self.hits = 0
+        self.bytes = 0
+        self.error = None
+        self.started = time.time()
+        self.finished = None
+        self.future = None
+
+    def progress(self, slice_id, pages, hits, response_bytes=0):
+        """Progress callback for ElasticAPI._search_async"""
+
+        self.pages = pages
+        self.hits = hits
+        self.bytes = response_bytes
+        self._update()
+
+    def done(self, status, error=None):
+        self.status = status
+        self.error = error
+        self.finished = time.time()
+        self._update()
+
+    def elapsed(self):
+        return (self.finished or time.time()) - self.started
+
+    def describe(self):
+        """A one line Markdown summary of the query"""
+
+        summary = (f"**{self.name}:** {self.status}, {self.pages} pages, {self.hits} hits, "
+                   f"{self.bytes} bytes in {self.elapsed():.1f}s")
+
+        if self.error is not None:
+            summary += f" ({self.error})"
+
+        return summary
+
+    def _update(self):
+        if self.on_update is not None:
+            self.on_update(self)
+
+
+class BackgroundRunner:
+    """Runs searches on an asyncio event loop in its own thread, so cells return right away
+
+    The loop is started the first time a query is submitted. Queries are tracked by name,
+    and can be awaited from a (blocking) line magic or cancelled, which cancels the task
+    and lets the search release its point in time or scroll.
+    """
+
+    def __init__(self):
+        self.loop = None
+        self.queries = {}
+        self.counter = count(1)
+
+    def next_name(self):
+        """Pick an unused name for a query, which is also the variable its results go in"""
+
+        name = f"es_bg_{next(self.counter)}"
+
+        while name in self.queries:
+            name = f"es_bg_{next(self.counter)}"
+
+        return name
+
+    def submit(self, query, coroutine):
+        """Start running a coroutine in the background on behalf of a BackgroundQuery
+
+        Args:
+            query (BackgroundQuery): tracks the coroutine's progress and outcome
+            coroutine (coroutine): does the actual work, and returns the results
+
+        Returns:
+            BackgroundQuery: the query that was passed in, now running
+        """
+
+        if self.loop is None:
+            self.loop = asyncio.new_event_loop()
+            Thread(target=self.loop.run_forever, name="es-background", daemon=True).start()
+
+        self.queries[query.name] = query
+        query.future = asyncio.run_coroutine_threadsafe(self._track(query, coroutine), self.loop)
+
+        return query
+
+    async def _track(self, query, coroutine):
+        try:
+            result = await coroutine
+
+        except asyncio.CancelledError:
+            query.done("cancelled")
+            raise
+
+        except Exception as e:
+            query.done("failed", str(e))
+            raise
+
+        query.done("done")
+
+        return result
+
+    def wait(self, name, timeout=None):
+        """Block until a query finishes
+
+        Returns:
+            the query's result, or None if it was cancelled or failed
+        """
+
+        query = self.queries[name]
+
+        try:
+            return query.future.result(timeout)
+
+        except (Exception, asyncio.CancelledError):
+            return None
+
+    def cancel(self, name):
+        """Cancel a running query
+
+        Returns:
+            bool: True if it was still running and is now being cancelled
+        """
+
+        return self.queries[name].future.cancel()
+
+    def describe(self):
+        """Summarize every background query as Markdown"""
+
+        if not self.queries:
+            return "No background queries"
+
+        return "#### Background queries\n***\n" + "".join(f"* {query.describe()}\n" for query in self.queries.values())
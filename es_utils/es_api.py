@@ -1,8 +1,122 @@
-from elasticsearch import Elasticsearch
+import asyncio
+import json
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from hashlib import sha1
+from importlib.util import find_spec
+from queue import Queue, Full
+from threading import Event, Lock
+from es_utils.index_catalog import IndexCatalog
+from es_utils.transport_options import (ARROW_MIMETYPE, client_options, make_arrow_serializer, make_serializer,
+                                       parse_bool, parse_transport_options)
+from es_utils.typed_frame import flatten_mapping
+
+
+class ResultBudget:
+    """Thread-safe count of how many more hits, and bytes of hits, a search is allowed to keep
+
+    Sliced searches share one budget, so the combined result never goes past
+    es_max_results (or es_max_bytes) no matter how many slices are draining at once.
+    """
+
+    def __init__(self, max_results, max_bytes=None):
+        self.remaining = max_results
+        self.remaining_bytes = max_bytes or None
+        self.bytes_exhausted = False
+        self.lock = Lock()
+
+    def take(self, count, hit_bytes=0):
+        """Claim up to count hits, of about hit_bytes each, and return how many were granted
+
+        With a byte budget, only the hits that fit in what's left of it are granted, and
+        the budget is emptied once they stop fitting.
+        """
+        with self.lock:
+            granted = max(min(count, self.remaining), 0)
+
+            if self.remaining_bytes is not None and hit_bytes > 0:
+                fits = int(self.remaining_bytes // hit_bytes)
+
+                if fits < granted:
+                    granted = fits
+                    self.bytes_exhausted = True
+
+                self.remaining_bytes -= granted * hit_bytes
+
+            self.remaining = 0 if self.bytes_exhausted else self.remaining - granted
+
+            return granted
+
+    def cancel(self):
+        """Empty the budget so every slice stops after its current page"""
+        with self.lock:
+            self.remaining = 0
+
+
+class PageSizer:
+    """Picks the size of each page of a search from what the pages so far have cost
+
+    Each page's hits are measured by encoding a sample of them as JSON, roughly what they
+    cost on the wire and in memory. With a target, the next page is sized to come to about
+    target_bytes, and to come back within slow_page seconds, growing at most twofold a
+    page. Without one, every page is the starting size, but hits are still measured when
+    measure is set (for es_max_bytes).
+    """
+
+    # Elasticsearch won't return more than index.max_result_window (10000 by default) hits at once
+    max_size = 10000
+    min_size = 10
+    sample_size = 20
+
+    def __init__(self, size, target_bytes=None, slow_page=None, measure=False):
+        self.size = size
+        self.target_bytes = target_bytes or None
+        self.slow_page = slow_page
+        self.measure = measure or self.target_bytes is not None
+        self.hit_bytes = None
+
+    def observe(self, hits, seconds):
+        """Learn from a page of hits and how long it took, and return the average bytes per hit
+
+        Returns 0 when we aren't measuring, or haven't seen any hits yet.
+        """
+
+        if not self.measure or not hits:
+            return self.hit_bytes or 0
+
+        sample = hits[::max(len(hits) // self.sample_size, 1)][:self.sample_size]
+        hit_bytes = len(json.dumps(sample, default=str)) / len(sample)
+        self.hit_bytes = hit_bytes if self.hit_bytes is None else (self.hit_bytes + hit_bytes) / 2
+
+        if self.target_bytes is not None:
+            size = self.target_bytes / self.hit_bytes
+
+            if self.slow_page and seconds > self.slow_page:
+                size = min(size, len(hits) * self.slow_page / seconds)
+
+            self.size = int(max(self.min_size, min(size, self.size * 2, self.max_size)))
+
+        return self.hit_bytes
 
 
 class ElasticAPI:
 
+    # Clients shared by every ElasticAPI with the same connection settings, so reconnecting
+    # to an instance reuses its connection pool instead of throwing it away
+    clients = {}
+    clients_lock = Lock()
+
+    # Statuses we back off and retry ourselves
+    retry_statuses = (429, 503)
+
+    # How far --preview counts matches before settling for "at least this many"
+    preview_total_hits = 10000
+
+    # ES|QL returns at most 1000 rows unless the query has a LIMIT of its own
+    esql_limit = re.compile(r"\|\s*limit\s+\d+", re.IGNORECASE)
+
     # https://elasticsearch-py.readthedocs.io/en/v8.12.0/api/elasticsearch.html
     def __init__(self, host, port, scheme, username, password, **kwargs):
 
@@ -19,17 +133,56 @@ class ElasticAPI:
         except KeyError:
             pass
 
+        # Transport tuning options (pool_size, compress, retries, etc.) are validated here,
+        # so a bad value is reported when connecting rather than on the first query
+        self.transport, kwargs = parse_transport_options(kwargs)
+        es_options.update(client_options(self.transport))
+
         # IMPORTANT NOTE: the kwargs we pass in come from es_full when we instantiate
         # this class. The line below (es_options.update(kwargs)) allows us to set options
         # in our environment variables, and have them automatically added to es_options.
         # Consider it a way to add to, or override, default values. It's cool, I know. I wrote it.
         es_options.update(kwargs)
 
-        self.session = Elasticsearch(
-            [{"host": host, "port": port, "scheme": scheme}],
-            basic_auth=(username, password),
-            **es_options
-        )
+        # The clients are built from these the first time they're needed, not when we connect,
+        # so loading the integration doesn't pay for importing elasticsearch and setting up transports
+        self.client_args = ([{"host": host, "port": port, "scheme": scheme}],)
+        self.client_kwargs = dict(es_options, basic_auth=(username, password))
+        self._session = None
+        self.async_session = None
+        self.index_catalog = IndexCatalog(self._fetch_indices)
+        self.field_types = {}
+
+    def _client_settings(self):
+        """The keyword arguments for a client, with its serializer if the instance picked one, and Arrow's"""
+
+        serializers = {ARROW_MIMETYPE: make_arrow_serializer()}
+        serializer = make_serializer(self.transport["serializer"])
+
+        # The client won't take serializer and serializers together, and uses a JSON one for the
+        # compatibility mode mimetype too
+        if serializer is not None:
+            serializers[serializer.mimetype] = serializer
+
+        return dict(self.client_kwargs, serializers=serializers)
+
+    @property
+    def session(self):
+        """The Elasticsearch client, built on the first request or shared with an earlier connection"""
+
+        if self._session is None:
+            key = sha1(json.dumps([self.client_args, self.client_kwargs, self.transport], sort_keys=True,
+                                  default=str).encode("utf-8")).hexdigest()
+
+            with self.clients_lock:
+                if key not in self.clients:
+                    from elasticsearch import Elasticsearch
+
+                    self.clients[key] = Elasticsearch(*self.client_args, **self._client_settings())
+
+                self._session = self.clients[key]
+
+        return self._session
 
     def _handler(self, command, **kwargs):
         """Broker Elasticsearch commands"""
@@ -37,17 +190,59 @@ class ElasticAPI:
         return getattr(self, command)(**kwargs)
 
     def get_indices(self, **kwargs):
-        """Retrieve a list of index names from the Elasticsearch cluster, without
-            including system indexes
+        """Retrieve the indices in the Elasticsearch cluster, without including system indexes
+
+        The list comes from a per-instance catalog that's cached for es_index_cache_ttl
+        seconds and refreshed in the background after that.
+
+        Args:
+            kwargs (dict): the user's parsed input, with an optional wildcard (or prefix) "pattern",
+                "sort" order, "limit", and "refresh" to fetch the catalog again right away
 
         Returns:
-            list: a list of index names from the cluster
+            list: a dict per index with its name, health, docs, store_bytes and created (epoch millis)
         """
 
-        indices = [idx["index"] for idx in self.session.cat.indices(format="json") if not idx["index"].startswith(".")]
+        self.index_catalog.ttl = int(kwargs.get("es_index_cache_ttl") or self.index_catalog.ttl)
+        indices = self.index_catalog.get(refresh=kwargs.get("refresh"))
+
+        return self.index_catalog.filter(indices, kwargs.get("pattern"), kwargs.get("sort") or "name",
+                                         kwargs.get("limit"))
+
+    def _fetch_indices(self):
+        """Fetch the catalog of non-system indices from the cluster, for IndexCatalog"""
+
+        response = self.session.cat.indices(format="json", h="index,health,docs.count,store.size,creation.date",
+                                            bytes="b")
+
+        indices = [{
+            "index": idx["index"],
+            "health": idx.get("health"),
+            "docs": int(idx.get("docs.count") or 0),
+            "store_bytes": int(idx.get("store.size") or 0),
+            "created": int(idx.get("creation.date") or 0)
+        } for idx in response if not idx["index"].startswith(".")]
 
         return indices
 
+    def _field_types(self, index):
+        """Look up the Elasticsearch type of every field in an index (or pattern), from its mapping
+
+        Mappings are cached for as long as the index catalog (es_index_cache_ttl).
+
+        Returns:
+            dict: dotted field name -> Elasticsearch type
+        """
+
+        fetched, field_types = self.field_types.get(index, (0, None))
+
+        if field_types is None or time.time() - fetched > self.index_catalog.ttl:
+            response = self._request(self.session.indices.get_mapping, index=index)
+            field_types = flatten_mapping(getattr(response, "body", response))
+            self.field_types[index] = (time.time(), field_types)
+
+        return field_types
+
     def search(self, **kwargs):
         """Executes a user's Elasticsearch query against the specified index
 
@@ -55,63 +250,934 @@ class ElasticAPI:
             kwargs (dict): we should be passing in the user's parsed input,
                 which will include the index, user's query, scroll_size, and scroll_time.
                 The scroll_size, scroll_time, and max_search_results are all set by default
-                in the integration, but a user can adjust them.
+                in the integration, but a user can adjust them. The "paginate" key picks
+                between point-in-time ("pit", the default) and "scroll" pagination, and
+                "fields", "exclude" and "retrieve" limit what comes back for each hit.
+                A caller can pass its own "pit" dict ({"id": ..., "search_after": ...}) to keep
+                track of, or pick up from, where a point in time search has gotten to. With
+                "profile" set, the first page is sent with the Profile API, and the profile the
+                cluster sends back is appended to the caller's "profiles" list. "time_from" and
+                "time_to" limit the search to a range of "time_field", and "score" (or
+                es_score, when it isn't given) picks between a scored and a non-scoring search.
+                Point in time pages are resized to come to about es_page_bytes each (see
+                PageSizer), and the search stops once es_max_bytes of hits have come back.
 
-        Returns:
-            list: a list of hits from the API call
+        Yields:
+            list: one page of hits at a time, never more than max_search_results in total.
+                The point in time or scroll is released once the generator is exhausted or closed,
+                except that a caller's "pit" is left open if the search doesn't finish, so it can
+                be resumed before it expires.
         """
 
         index = kwargs.get("index")
-        user_query = kwargs.get("query")
-        scroll_size = kwargs.get("es_scroll_size")
+        paginate = kwargs.get("paginate") or "pit"
+        slices = kwargs.get("slices") or 1
+        progress = kwargs.get("progress")
+        stats = kwargs.get("stats")
         scroll_time = kwargs.get("es_scroll_time")
         max_search_results = kwargs.get("es_max_results")
-        total_results = 0
+        profiles = kwargs.get("profiles") if kwargs.get("profile") else None
+
+        body = self._search_body(**kwargs)
+        budget = ResultBudget(max_search_results, int(kwargs.get("es_max_bytes") or 0))
+
+        if paginate == "scroll":
+            def fetch(search_slice):
+                return self._search_scroll(index, body, self._page_sizer(**kwargs), scroll_time, budget, search_slice,
+                                           progress, stats, profiles=profiles)
+
+            yield from self._run_slices(fetch, slices, budget, stats)
+            self._note_budget(budget, stats)
+
+            return
+
+        pit = kwargs.get("pit")
+        resumable = pit is not None
+
+        if not resumable:
+            pit = {}
+
+        if pit.get("id") is None:
+            pit["id"] = self._request(self.session.open_point_in_time, stats, page=False, index=index,
+                                      keep_alive=scroll_time)["id"]
+
+        finished = False
+
+        try:
+            def fetch(search_slice):
+                return self._search_pit(pit, body, self._page_sizer(**kwargs), scroll_time, budget, search_slice,
+                                        progress, stats, profiles=profiles)
+
+            yield from self._run_slices(fetch, slices, budget, stats)
+            self._note_budget(budget, stats)
+            finished = True
+
+        finally:
+            if finished or not resumable:
+                self._request(self.session.close_point_in_time, stats, page=False, id=pit["id"])
+
+    def _page_sizer(self, **kwargs):
+        """A PageSizer for one slice of a search, from es_scroll_size, es_page_bytes and es_max_bytes
+
+        Pages that take more than a third of the request timeout are shrunk too, well before
+        they'd time out.
+        """
+
+        return PageSizer(kwargs.get("es_scroll_size"), int(kwargs.get("es_page_bytes") or 0),
+                         self.transport["request_timeout"] / 3, measure=bool(int(kwargs.get("es_max_bytes") or 0)))
+
+    def _note_budget(self, budget, stats):
+        """Record in the stats if a search stopped because it ran out of es_max_bytes"""
+
+        if stats is not None and budget.bytes_exhausted:
+            stats.reached_max_bytes()
+
+    def _run_slices(self, fetch, slices, budget, stats=None):
+        """Drain fetch once per slice, concurrently from a thread pool when there's more than one
+
+        Args:
+            fetch (callable): takes a slice definition (or None) and returns a generator
+                of that slice's pages
+            slices (int): how many slices to split the search into
+            budget (ResultBudget): the shared hit budget, emptied if any slice fails or
+                the caller stops reading, so the rest stop early
+            stats (QueryStats): where to record the time the caller spends waiting on the slices
+
+        Yields:
+            list: pages of hits from every slice, in the order they arrive
+        """
+
+        if slices <= 1:
+            yield from fetch(None)
+
+            return
+
+        # A small queue keeps the slices from racing far ahead of whoever is consuming the pages
+        pages = Queue(maxsize=slices * 2)
+        stop = Event()
+        done = object()
+
+        def drain(search_slice):
+            try:
+                with closing(fetch(search_slice)) as slice_pages:
+                    for page in slice_pages:
+                        if not put(page):
+                            break
+
+                put(done)
+
+            except Exception as e:
+                put(e)
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=0.1)
+                    return True
+
+                except Full:
+                    continue
+
+            return False
+
+        with ThreadPoolExecutor(max_workers=slices) as pool:
+            for slice_id in range(slices):
+                pool.submit(drain, {"id": slice_id, "max": slices})
+
+            try:
+                finished = 0
+
+                while finished < slices:
+                    started = time.perf_counter()
+                    page = pages.get()
+
+                    if stats is not None:
+                        stats.add_wait(time.perf_counter() - started)
+
+                    if page is done:
+                        finished += 1
+
+                    elif isinstance(page, Exception):
+                        raise page
+
+                    else:
+                        yield page
+
+            finally:
+                stop.set()
+                budget.cancel()
+
+    def _sample(self, **kwargs):
+        """Take a quick look at a search's results in a single request, for --sample and --preview
+
+        --sample N runs a _count first, for the exact number of matches (skipping the search
+        when there are none), then picks N documents with random_score. --preview N returns
+        the first N documents in index order, the cheapest request there is, and counts
+        matches with track_total_hits up to preview_total_hits, so its total is an estimate
+        (a lower bound) on big result sets.
+
+        Returns:
+            dict: the "hits", and the "total" matches with its "relation", "eq" if it's exact or
+                "gte" if it's a lower bound
+        """
+
+        index = kwargs.get("index")
+        stats = kwargs.get("stats")
+        body = self._search_body(**kwargs)
+
+        if kwargs.get("preview"):
+            size = min(kwargs.get("preview"), kwargs.get("es_max_results"))
+            response = self._request(self.session.search, stats, index=index, size=size,
+                                     **dict(body, sort=["_doc"], track_total_hits=self.preview_total_hits))
+            total = response.get("hits", {}).get("total", {"value": 0, "relation": "eq"})
+
+            return {"hits": response.get("hits", {}).get("hits", []), "total": total["value"],
+                    "relation": total["relation"]}
+
+        count = self._request(self.session.count, stats, index=index, query=body["query"])["count"]
+
+        if count == 0:
+            return {"hits": [], "total": 0, "relation": "eq"}
+
+        # The sample is the top hits by random score, so it can't be sorted on anything else
+        body.pop("sort", None)
+        random_score = {} if kwargs.get("seed") is None else {"seed": kwargs.get("seed"), "field": "_seq_no"}
+        body["query"] = {"function_score": {"query": body["query"], "random_score": random_score,
+                                            "boost_mode": "replace"}}
+        size = min(kwargs.get("sample"), kwargs.get("es_max_results"))
+        response = self._request(self.session.search, stats, index=index, size=size,
+                                 **dict(body, track_total_hits=False))
+
+        return {"hits": response.get("hits", {}).get("hits", []), "total": count, "relation": "eq"}
+
+    def esql(self, **kwargs):
+        """Run an ES|QL query, asking for the results in Apache Arrow format
+
+        Arrow is columnar, so pandas can take it as it is, without a Python object for every
+        value. Without pyarrow installed, or on clusters that can't send Arrow, the results
+        come back as columnar JSON instead, one list per column. ES|QL answers in a single
+        response; a query without a LIMIT gets one of es_max_results (which the cluster caps
+        at its esql.query.result_truncation_max_size, 10000 by default).
+
+        Yields:
+            dict: the one page of results, either a "table" (a pyarrow Table), or the
+                "columns" (the name and type of each) and their "values" (one list per column)
+        """
+
+        stats = kwargs.get("stats")
+        query = kwargs.get("query")
+
+        if not self.esql_limit.search(query):
+            query = f"{query}\n| LIMIT {kwargs.get('es_max_results')}"
+
+        if find_spec("pyarrow") is not None:
+            try:
+                response = self._request(self.session.esql.query, stats, query=query, format="arrow")
+
+            except Exception as e:
+                # Only fall back to JSON when it's the format the cluster objected to
+                if getattr(e, "status_code", None) != 400 or "arrow" not in str(e).lower():
+                    raise
+
+            else:
+                yield {"table": response.body}
+
+                return
+
+        response = self._request(self.session.esql.query, stats, query=query, columnar=True)
+
+        yield {"columns": response["columns"], "values": response["values"]}
+
+    def sql(self, **kwargs):
+        """Run an SQL query, paging through the results with a cursor
+
+        The SQL API can't send Arrow, so each page is columnar JSON, one list per column.
+        Pages are es_scroll_size rows, up to es_max_results rows in all, and the cursor is
+        closed if we stop before the last one.
+
+        Yields:
+            dict: a page of results, the "columns" (the name and type of each) and their
+                "values" (one list per column)
+        """
+
+        stats = kwargs.get("stats")
+        budget = ResultBudget(kwargs.get("es_max_results"))
+        fetch_size = min(kwargs.get("es_scroll_size"), kwargs.get("es_max_results"))
+        cursor = None
+
+        if fetch_size <= 0:
+            return
+
+        try:
+            response = self._request(self.session.sql.query, stats, query=kwargs.get("query"), fetch_size=fetch_size,
+                                     columnar=True)
+            columns = response["columns"]
+
+            while True:
+                cursor = response.get("cursor")
+                values = response.get("values") or [[] for _ in columns]
+                kept = budget.take(len(values[0]) if values else 0)
+
+                yield {"columns": columns, "values": [column[:kept] for column in values]}
+
+                if cursor is None or budget.remaining <= 0:
+                    break
+
+                response = self._request(self.session.sql.query, stats, cursor=cursor, columnar=True)
+
+        finally:
+            if cursor is not None:
+                self._request(self.session.sql.clear_cursor, stats, page=False, cursor=cursor)
+
+    def msearch(self, **kwargs):
+        """Send several queries to the cluster in one _msearch request
+
+        The first page of every query comes back from a single round trip. Queries with
+        more hits than that are then re-run in full with point in time pagination,
+        concurrently from a thread pool.
+
+        Args:
+            kwargs (dict): the user's parsed input, where "query" is a list of query lines.
+                A line starting with @index runs against that index instead of the default.
+
+        Returns:
+            dict: label (q1, q2, ...) -> the query's index, query, pages of hits, and error (if it failed)
+        """
+
+        page_size = min(kwargs.get("es_scroll_size"), kwargs.get("es_max_results"))
+        retrieval = self._build_retrieval(kwargs.get("fields"), kwargs.get("exclude"), kwargs.get("retrieve"))
+        results = {}
+        searches = []
+
+        # The client only renames source to _source for search(), msearch bodies go over the wire as they are
+        if "source" in retrieval:
+            retrieval["_source"] = retrieval.pop("source")
+
+        for position, line in enumerate(kwargs.get("query") or [], start=1):
+            index = kwargs.get("index")
+
+            if line.startswith("@"):
+                index, _, line = line[1:].partition(" ")
+
+            results[f"q{position}"] = {"index": index, "query": line.strip(), "pages": [], "error": None}
+            searches.append({"index": index})
+            searches.append(dict(retrieval, query=self._build_query(line.strip()), size=page_size))
+
+        if not searches:
+            return results
+
+        responses = self._request(self.session.msearch, kwargs.get("stats"), searches=searches)["responses"]
+        follow_ups = []
+
+        for (label, result), response in zip(results.items(), responses):
+            if "error" in response:
+                result["error"] = str(response["error"].get("reason", response["error"]))
+
+            elif len(response["hits"]["hits"]) < page_size or page_size >= kwargs.get("es_max_results"):
+                result["pages"].append(response["hits"]["hits"])
+
+            else:
+                follow_ups.append(label)
+
+        def fetch_all(label):
+            search_input = dict(kwargs, index=results[label]["index"], query=results[label]["query"], slices=1)
+            return list(self.search(**search_input))
+
+        if follow_ups:
+            started = time.perf_counter()
+
+            with ThreadPoolExecutor(max_workers=min(len(follow_ups), 8)) as pool:
+                for label, pages in zip(follow_ups, pool.map(fetch_all, follow_ups)):
+                    results[label]["pages"] = pages
+
+            # The follow ups' requests are made on the pool's threads, so record our wait for them
+            if kwargs.get("stats") is not None:
+                kwargs["stats"].add_wait(time.perf_counter() - started)
+
+        return results
+
+    def aggregate(self, **kwargs):
+        """Run an aggregation on the cluster without pulling back any documents
+
+        Args:
+            kwargs (dict): the user's parsed input, with the index and query, the "group_by"
+                buckets (outermost first) and "metric" aggregations, and "composite" to page
+                through every bucket with a composite aggregation, up to es_max_results
+
+        Returns:
+            dict: the total hit count, and either the aggregation tree ("aggregations")
+                or every composite bucket ("buckets")
+        """
+
+        index = kwargs.get("index")
+        group_by = kwargs.get("group_by") or []
+        metrics = self._build_metrics(kwargs.get("metric") or [])
+        query = self._build_query(kwargs.get("query"))
+
+        if not kwargs.get("composite"):
+            response = self._request(
+                self.session.search,
+                kwargs.get("stats"),
+                index=index,
+                query=query,
+                size=0,
+                aggs=self._build_buckets(group_by, metrics),
+                track_total_hits=not group_by,
+                timeout="30s"
+            )
 
-        search_results = []
+            # Without track_total_hits the response has no hits.total, the buckets carry their own counts
+            total = response["hits"].get("total", {}).get("value")
+
+            return {"total": total, "aggregations": response.get("aggregations", {})}
+
+        max_buckets = kwargs.get("es_max_results")
+        composite = {
+            "size": min(kwargs.get("es_scroll_size"), max_buckets),
+            "sources": [{f"group_{depth}": self._build_bucket(group, composite=True)}
+                        for depth, group in enumerate(group_by)]
+        }
+        buckets = []
+        total = None
+
+        while len(buckets) < max_buckets:
+            response = self._request(
+                self.session.search,
+                kwargs.get("stats"),
+                index=index,
+                query=query,
+                size=0,
+                aggs={"composite": {"composite": composite, "aggs": metrics}},
+                timeout="30s"
+            )
+
+            total = response["hits"].get("total", {}).get("value")
+            page = response["aggregations"]["composite"]
+            buckets.extend(page["buckets"][:max_buckets - len(buckets)])
+
+            if "after_key" not in page or len(page["buckets"]) < composite["size"]:
+                break
+
+            composite["after"] = page["after_key"]
+
+        return {"total": total, "buckets": buckets}
+
+    def _build_bucket(self, group, composite=False):
+        """Turn a --group-by spec into a terms or date_histogram aggregation (or composite source)"""
+
+        if group["type"] == "terms":
+            bucket = {"field": group["field"]}
+
+            if not composite:
+                bucket["size"] = group["size"]
+
+            return {"terms": bucket}
+
+        # Single calendar units like 1h or 1d can follow the calendar, anything else is a fixed interval
+        interval = group["interval"]
+        interval_type = "calendar_interval" if interval in ("1m", "1h", "1d", "1w", "1M", "1q", "1y") \
+            else "fixed_interval"
+        bucket = {"field": group["field"], interval_type: interval}
+
+        # Composite sources return epoch millis unless asked for something readable
+        if composite:
+            bucket["format"] = "strict_date_optional_time"
+
+        return {"date_histogram": bucket}
+
+    def _build_buckets(self, group_by, metrics):
+        """Nest the bucket aggregations inside each other, with the metrics at the innermost level"""
+
+        aggs = metrics
+
+        for depth in reversed(range(len(group_by))):
+            bucket = self._build_bucket(group_by[depth])
+
+            if aggs:
+                bucket["aggs"] = aggs
+
+            aggs = {f"group_{depth}": bucket}
+
+        return aggs
+
+    def _build_metrics(self, metrics):
+        """Turn the --metric specs into metric aggregations named metric_0, metric_1, etc."""
+
+        aggs = {}
+
+        for position, metric in enumerate(metrics):
+            agg = {"field": metric["field"]}
+
+            if metric["type"] == "percentiles":
+                agg["percents"] = metric["percents"]
+
+            aggs[f"metric_{position}"] = {metric["type"]: agg}
+
+        return aggs
+
+    def _search_body(self, **kwargs):
+        """Build the query and retrieval parameters for a search from the user's parsed input
+
+        A time range ("time_from" and/or "time_to", as dates or date math like now-1h) is a
+        range filter on time_field, so Elasticsearch can skip the shards and indices outside
+        it, which it can't do for a range written into the query string.
+
+        An incremental search ("incremental" with a "since" high water mark, in epoch millis)
+        only matches documents whose time_field is at or after the mark, and always gets the
+        time field back. It's sorted oldest first on time_field, so a run cut short by
+        es_max_results stops at the oldest documents it didn't fetch, and the next run picks
+        up from there. The sort is on the field as a date, so each hit's first sort value is
+        its time in epoch millis (even for date_nanos), which the next high water mark is
+        read from.
+
+        A non-scoring search (see _build_query) is also sorted on _doc, and doesn't count
+        every match (track_total_hits), so each page only costs the shards the hits on it.
+
+        The response is trimmed with filter_path to the parts of each hit we turn into
+        columns, so nothing else (_score, _ignored, etc.) is ever decoded into Python objects.
+        """
+
+        filters = []
+        required = []
+        score = self._scoring(**kwargs)
+        time_range = {bound: kwargs.get(name) for bound, name in (("gte", "time_from"), ("lte", "time_to"))
+                      if kwargs.get(name) is not None}
+
+        if time_range:
+            filters.append({"range": {kwargs.get("time_field"): time_range}})
+
+        if kwargs.get("incremental"):
+            required.append(kwargs.get("time_field"))
+
+            if kwargs.get("since") is not None:
+                filters.append({"range": {kwargs.get("time_field"): {"gte": kwargs.get("since"),
+                                                                      "format": "epoch_millis"}}})
+
+        body = {"query": self._build_query(kwargs.get("query"), filters, score)}
+        body.update(self._build_retrieval(kwargs.get("fields"), kwargs.get("exclude"), kwargs.get("retrieve"),
+                                          required))
+
+        if not score:
+            body.update({"sort": ["_doc"], "track_total_hits": False})
+
+        if kwargs.get("incremental"):
+            body["sort"] = [{kwargs.get("time_field"): {"order": "asc", "numeric_type": "date"}}]
+
+        body["filter_path"] = self._filter_path(kwargs.get("metadata") or kwargs.get("incremental"),
+                                                kwargs.get("profile"))
+
+        return body
+
+    def _scoring(self, **kwargs):
+        """Whether a search should score its hits: --score/--no-score, or es_score if neither was given"""
+
+        score = kwargs.get("score")
+
+        return parse_bool(kwargs.get("es_score", True)) if score is None else score
+
+    def _filter_path(self, metadata=False, profile=False):
+        """The parts of a search or scroll response we read, for its filter_path parameter
+
+        Args:
+            metadata (bool): also keep each hit's _id and _index
+            profile (bool): also keep the Profile API's results
+        """
+
+        hit_fields = ["_source", "fields", "sort"] + (["_id", "_index"] if metadata else [])
+
+        return ["took", "timed_out", "_shards.failures", "pit_id", "_scroll_id", "hits.total"] \
+            + (["profile"] if profile else []) + [f"hits.hits.{field}" for field in hit_fields]
+
+    def _profile_page(self, params, pages, search_slice, profiles):
+        """Ask for a profile of the search's first page, when the caller wants one
+
+        Only the first slice is profiled, each slice would only repeat the same query plan.
+        """
+
+        if profiles is not None and pages == 0 and (search_slice is None or search_slice["id"] == 0):
+            params["profile"] = True
+
+        return params
+
+    def _build_query(self, user_query, filters=None, score=True):
+        """Wrap the user's query string in the query clause we send to Elasticsearch
+
+        Args:
+            user_query (str): the user's query string
+            filters (list): extra query clauses every hit must match, without affecting scoring
+            score (bool): if False, the query string goes in filter context too, under
+                constant_score, so nothing is scored and its matches can be cached
+        """
+
+        if not score:
+            query_string = {"query_string": {"query": user_query, "default_operator": "AND"}}
+
+            return {"constant_score": {"filter": {"bool": {"filter": [query_string] + (filters or [])}}}}
 
         query = {
-            "query": {
-                "bool": {
-                    "minimum_should_match": 1,
-                    "should": [
-                        {
-                            "query_string": {
-                                "query": user_query,
-                                "default_operator": "AND"
-                            }
+            "bool": {
+                "minimum_should_match": 1,
+                "should": [
+                    {
+                        "query_string": {
+                            "query": user_query,
+                            "default_operator": "AND"
                         }
-                    ]
-                }
-            },
-            "size": scroll_size,
-            "from": 0
+                    }
+                ]
+            }
         }
 
-        response = self.session.search(
-            index=index,
-            scroll=scroll_time,
-            body=query,
-            timeout='30s'
-        )
+        if filters:
+            query["bool"]["filter"] = filters
+
+        return query
+
+    def _build_retrieval(self, fields=None, exclude=None, retrieve=None, required=None):
+        """Work out which parts of each document the cluster should send back
+
+        Args:
+            fields (list): field names or wildcard patterns to return, all of them if empty
+            exclude (list): field names or wildcard patterns to leave out of _source
+            retrieve (str): "source" filters _source (the default), "fields" uses the
+                fields API and "docvalues" reads docvalue_fields, skipping _source entirely
+            required (list): fields we need back even if the user didn't ask for them
+
+        Returns:
+            dict: the extra search parameters to send with every page
+        """
+
+        if fields and required:
+            fields = fields + [field for field in required if field not in fields]
+
+        if retrieve == "fields":
+            return {"source": False, "fields": fields or ["*"]}
+
+        if retrieve == "docvalues":
+            return {"source": False, "docvalue_fields": fields or ["*"]}
+
+        if fields or exclude:
+            return {"source": {"includes": fields or [], "excludes": exclude or []}}
+
+        return {}
+
+    def _pit_params(self, pit, body, size, keep_alive, search_slice=None, search_after=None):
+        """Build the parameters for one page of a point in time search
+
+        Pages are sorted on _shard_doc, the cheapest order, or after the body's own field
+        sort (an incremental search's time_field) with _shard_doc as the tiebreaker.
+        """
+
+        sort = [field for field in body.get("sort", []) if field != "_doc"]
+        search_params = dict(body)
+        search_params.update({
+            "size": size,
+            "pit": {"id": pit["id"], "keep_alive": keep_alive},
+            "sort": sort + [{"_shard_doc": "asc"}],
+            "timeout": "30s"
+        })
+
+        if search_slice is not None:
+            search_params["slice"] = search_slice
+
+        if search_after is not None:
+            search_params["search_after"] = search_after
+
+        return search_params
+
+    def _scroll_params(self, index, body, size, scroll_time, search_slice=None):
+        """Build the parameters for the search that opens a scroll"""
+
+        search_params = dict(body)
+        search_params.update({
+            "index": index,
+            "scroll": scroll_time,
+            "size": size,
+            "timeout": "30s"
+        })
+
+        if search_slice is not None:
+            search_params["slice"] = search_slice
+
+        return search_params
+
+    def _search_pit(self, pit, body, pager, keep_alive, budget, search_slice=None, progress=None, stats=None,
+                    profiles=None):
+        """Page through results with a point in time and search_after, sorted on _shard_doc (see _pit_params)
+
+        Each request asks for as many hits as the PageSizer picks, but never more than the
+        budget still allows, so we stop at exactly max_search_results, and a short page
+        means there's nothing left to fetch.
+        Opening and closing the point in time is left to the caller, so sliced searches
+        can share one. An unsliced search picks up from, and records, pit["search_after"].
+        """
+
+        search_after = pit.get("search_after") if search_slice is None else None
+        pages = 0
+        total_hits = 0
+        total_bytes = 0
+
+        while budget.remaining > 0:
+            size = min(pager.size, budget.remaining)
+
+            params = self._pit_params(pit, body, size, keep_alive, search_slice, search_after)
+            started = time.perf_counter()
+            response = self._request(self.session.search, stats,
+                                     **self._profile_page(params, pages, search_slice, profiles))
+            elapsed = time.perf_counter() - started
+
+            if "profile" in params:
+                profiles.append(response.get("profile", {}))
+
+            # The cluster may hand back a new id for the point in time, always use the latest
+            pit["id"] = response.get("pit_id", pit["id"])
+            hits = response.get("hits", {}).get("hits", [])
+            page = hits[:budget.take(len(hits), pager.observe(hits, elapsed))]
+            pages += 1
+            total_hits += len(page)
+            total_bytes += self._response_bytes(response)
+
+            self._report_progress(progress, search_slice, pages, total_hits, total_bytes)
+
+            # Record where we are, so a search resumed with this pit picks up after this page
+            if search_slice is None and page:
+                pit["search_after"] = page[-1]["sort"]
+
+            yield page
+
+            if len(hits) < size:
+                break
+
+            search_after = hits[-1]["sort"]
+
+    def _search_scroll(self, index, body, pager, scroll_time, budget, search_slice=None, progress=None,
+                       stats=None, profiles=None):
+        """Page through results with the scroll API, for clusters without point in time support
+
+        A scroll's page size is set when it's opened, so the PageSizer only measures the
+        hits here, for the byte budget.
+        """
+
+        scroll_id = None
+        scroll_size = min(pager.size, budget.remaining)
+        pages = 0
+        total_hits = 0
+        total_bytes = 0
+
+        if scroll_size <= 0:
+            return
+
+        try:
+            params = self._scroll_params(index, body, scroll_size, scroll_time, search_slice)
+            started = time.perf_counter()
+            response = self._request(self.session.search, stats,
+                                     **self._profile_page(params, pages, search_slice, profiles))
+
+            if "profile" in params:
+                profiles.append(response.get("profile", {}))
+
+            while True:
+                scroll_id = response.get("_scroll_id", scroll_id)
+                hits = response.get("hits", {}).get("hits", [])
+
+                # Only keep the hits we still need, then stop without asking for another batch
+                page = hits[:budget.take(len(hits), pager.observe(hits, time.perf_counter() - started))]
+                pages += 1
+                total_hits += len(page)
+                total_bytes += self._response_bytes(response)
+
+                self._report_progress(progress, search_slice, pages, total_hits, total_bytes)
+
+                yield page
+
+                if budget.remaining <= 0 or len(hits) < scroll_size:
+                    break
+
+                started = time.perf_counter()
+                response = self._request(self.session.scroll, stats, scroll_id=scroll_id, scroll=scroll_time,
+                                         filter_path=body.get("filter_path"))
+
+        finally:
+            if scroll_id is not None:
+                self._request(self.session.clear_scroll, stats, page=False, scroll_id=scroll_id)
+
+    def _async_session(self):
+        """Build the AsyncElasticsearch client for background searches the first time it's needed
+
+        It uses the same connection settings as our regular client, and needs aiohttp installed.
+        """
+
+        if self.async_session is None:
+            from elasticsearch import AsyncElasticsearch
+
+            self.async_session = AsyncElasticsearch(*self.client_args, **self._client_settings())
+
+        return self.async_session
+
+    async def _search_async(self, **kwargs):
+        """The async generator twin of search, used to run searches in the background
+
+        Takes the same parsed input as search, and yields pages of hits the same way,
+        releasing the point in time or scroll when it's exhausted, closed or cancelled.
+        Slices aren't supported, a background search pages through one slice.
+        """
+
+        index = kwargs.get("index")
+        paginate = kwargs.get("paginate") or "pit"
+        progress = kwargs.get("progress")
+        stats = kwargs.get("stats")
+        scroll_time = kwargs.get("es_scroll_time")
+
+        body = self._search_body(**kwargs)
+        budget = ResultBudget(kwargs.get("es_max_results"), int(kwargs.get("es_max_bytes") or 0))
+        pager = self._page_sizer(**kwargs)
+        session = self._async_session()
+        pages = 0
+        total_hits = 0
+        total_bytes = 0
+
+        if paginate == "scroll":
+            scroll_id = None
+            scroll_size = min(pager.size, budget.remaining)
+
+            try:
+                started = time.perf_counter()
+                response = await self._request_async(session.search, stats,
+                                                     **self._scroll_params(index, body, scroll_size, scroll_time))
+
+                while True:
+                    scroll_id = response.get("_scroll_id", scroll_id)
+                    hits = response.get("hits", {}).get("hits", [])
+                    page = hits[:budget.take(len(hits), pager.observe(hits, time.perf_counter() - started))]
+                    pages += 1
+                    total_hits += len(page)
+                    total_bytes += self._response_bytes(response)
+
+                    self._report_progress(progress, None, pages, total_hits, total_bytes)
+
+                    yield page
+
+                    if budget.remaining <= 0 or len(hits) < scroll_size:
+                        break
+
+                    started = time.perf_counter()
+                    response = await self._request_async(session.scroll, stats, scroll_id=scroll_id,
+                                                         scroll=scroll_time, filter_path=body.get("filter_path"))
+
+                self._note_budget(budget, stats)
+
+            finally:
+                if scroll_id is not None:
+                    await self._request_async(session.clear_scroll, stats, page=False, scroll_id=scroll_id)
+
+            return
+
+        pit = {"id": (await self._request_async(session.open_point_in_time, stats, page=False, index=index,
+                                                keep_alive=scroll_time))["id"]}
+        search_after = None
+
+        try:
+            while budget.remaining > 0:
+                size = min(pager.size, budget.remaining)
+
+                started = time.perf_counter()
+                response = await self._request_async(session.search, stats,
+                                                     **self._pit_params(pit, body, size, scroll_time,
+                                                                        search_after=search_after))
+
+                pit["id"] = response.get("pit_id", pit["id"])
+                hits = response.get("hits", {}).get("hits", [])
+                page = hits[:budget.take(len(hits), pager.observe(hits, time.perf_counter() - started))]
+                pages += 1
+                total_hits += len(page)
+                total_bytes += self._response_bytes(response)
+
+                self._report_progress(progress, None, pages, total_hits, total_bytes)
+
+                yield page
+
+                if len(hits) < size:
+                    break
+
+                search_after = hits[-1]["sort"]
+
+            self._note_budget(budget, stats)
+
+        finally:
+            await self._request_async(session.close_point_in_time, stats, page=False, id=pit["id"])
+
+    def _request(self, call, stats=None, page=True, **params):
+        """Make a request to the cluster, recording how long it took in stats if we were given some
+
+        Requests rejected with 429 or 503 are retried after an exponential backoff,
+        up to the instance's retries option. Requests that don't bring back results, like
+        opening a point in time, are made with page=False (see QueryStats.add_response).
+        """
+
+        attempt = 0
+
+        while True:
+            started = time.perf_counter()
+
+            try:
+                response = call(**params)
+                break
+
+            except Exception as e:
+                if not self._should_retry(e, attempt):
+                    raise
+
+                time.sleep(self._backoff(attempt))
+                attempt += 1
+
+        if stats is not None:
+            stats.add_response(response, time.perf_counter() - started, self._response_bytes(response), page)
+
+        return response
+
+    async def _request_async(self, call, stats=None, page=True, **params):
+        """The async twin of _request"""
+
+        attempt = 0
+
+        while True:
+            started = time.perf_counter()
+
+            try:
+                response = await call(**params)
+                break
+
+            except Exception as e:
+                if not self._should_retry(e, attempt):
+                    raise
+
+                await asyncio.sleep(self._backoff(attempt))
+                attempt += 1
+
+        if stats is not None:
+            stats.add_response(response, time.perf_counter() - started, self._response_bytes(response), page)
+
+        return response
+
+    def _should_retry(self, error, attempt):
+        return getattr(error, "status_code", None) in self.retry_statuses and attempt < self.transport["retries"]
 
-        scroll_id = response["_scroll_id"]
-        scroll_size = len(response["hits"]["hits"])
+    def _backoff(self, attempt):
+        """Seconds to wait before retrying, doubling every attempt up to 30 seconds"""
+        return min(self.transport["retry_backoff"] * 2 ** attempt, 30.0)
 
-        while scroll_size > 0 and total_results < max_search_results:
-            for hit in response["hits"]["hits"]:
-                search_results.append(hit)
+    def _response_bytes(self, response):
+        """How many bytes the cluster sent for a response, when it told us"""
 
-            # Update the total number of results we've processed so far
-            total_results += scroll_size
+        meta = getattr(response, "meta", None)
 
-            # Scroll to the next batch
-            response = self.session.scroll(scroll_id=scroll_id, scroll=scroll_time)
+        if meta is None:
+            return 0
 
-            # Update the scroll size and scroll_id
-            scroll_id = response["_scroll_id"]
-            scroll_size = len(response["hits"]["hits"])
+        return int(meta.headers.get("content-length", 0))
 
-        self.session.clear_scroll(scroll_id=scroll_id)
+    def _report_progress(self, progress, search_slice, pages, hits, response_bytes=0):
+        """Tell the caller how far a slice has gotten, if they asked to know"""
 
-        return search_results
+        if progress is not None:
+            progress(search_slice["id"] if search_slice is not None else 0, pages, hits, response_bytes)
@@ -0,0 +1,277 @@
+import json
+import os
+import sys
+import time
+from hashlib import sha1
+from es_utils.api_response_parser import ColumnBuilder
+
+
+class SearchExporter:
+    """Streams a search's pages to disk as Parquet or NDJSON, without holding the results in memory
+
+    A ".parquet" path is written as a directory of part files, one row group per page,
+    that pyarrow/pandas read back as a single dataset. Any other path (".ndjson", ".jsonl")
+    is written as one newline delimited JSON file. A checkpoint next to the output records
+    the point in time and search_after of the last page written, so an interrupted export
+    picks up where it left off when the same cell is run again, as long as the point in
+    time hasn't expired (es_scroll_time).
+    """
+
+    # Start a new Parquet part file every this many pages, so a hard kill only loses one part
+    pages_per_part = 100
+
+    def __init__(self, path):
+        self.path = path
+        self.parquet = path.endswith(".parquet")
+
+        if self.parquet:
+            self.checkpoint_path = os.path.join(path, "_checkpoint.json")
+        else:
+            self.checkpoint_path = f"{path}.checkpoint.json"
+
+    def run(self, session, **kwargs):
+        """Export every hit of the user's search, resuming from a checkpoint if there is one
+
+        Args:
+            session (ElasticAPI): the instance to search
+            kwargs (dict): the user's parsed search input. es_max_results and es_max_bytes don't
+                apply to exports, everything that matches the query is written.
+
+        Returns:
+            dict: a summary of the export with its path, format, rows, bytes and elapsed seconds
+        """
+
+        from elasticsearch import NotFoundError
+
+        started = time.time()
+        signature = self._signature(**kwargs)
+        checkpoint = self._load_checkpoint(signature)
+
+        if checkpoint["complete"]:
+            return self._summary(checkpoint, 0)
+
+        search_input = dict(kwargs, paginate="pit", slices=1, es_max_results=sys.maxsize, es_max_bytes=0)
+
+        try:
+            self._export(session, checkpoint, search_input)
+
+        except NotFoundError:
+            if checkpoint["pit"].get("id") is None:
+                raise
+
+            # The point in time expired before we got back to it, so start over from scratch
+            self._reset()
+            checkpoint = self._load_checkpoint(signature)
+            self._export(session, checkpoint, search_input)
+
+        return self._summary(checkpoint, time.time() - started)
+
+    def _export(self, session, checkpoint, search_input):
+        builder_args = {"metadata": search_input.get("metadata"), "fields": search_input.get("fields")}
+        writer = None
+        pages_in_part = 0
+
+        if self.parquet:
+            os.makedirs(self.path, exist_ok=True)
+            self._remove_incomplete_parts(checkpoint)
+        else:
+            with open(self.path, "ab") as out:
+                out.truncate(checkpoint["bytes"])
+
+        # The search moves its own copy of the point in time along as it fetches pages, the
+        # checkpoint only moves past a page once that page is on disk
+        search_pit = dict(checkpoint["pit"])
+        pages = session.search(**dict(search_input, pit=search_pit))
+
+        try:
+            for page in pages:
+                if not page:
+                    continue
+
+                if self.parquet:
+                    writer = self._write_parquet_page(writer, checkpoint, search_pit, page, builder_args)
+                    pages_in_part += 1
+
+                    if pages_in_part >= self.pages_per_part:
+                        self._close_part(writer, checkpoint)
+                        writer = None
+                        pages_in_part = 0
+
+                else:
+                    self._write_ndjson_page(checkpoint, search_pit, page, builder_args)
+
+            checkpoint["complete"] = True
+
+        finally:
+            pages.close()
+
+            if writer is not None:
+                self._close_part(writer, checkpoint)
+
+            self._save_checkpoint(checkpoint)
+
+    def _write_ndjson_page(self, checkpoint, search_pit, page, builder_args):
+        builder = ColumnBuilder.for_search(**builder_args)
+        builder.add_page(page)
+        columns = builder.finish()
+
+        with open(self.path, "ab") as out:
+            for row in range(builder.rows):
+                record = {name: values[row] for name, values in columns.items() if values[row] is not None}
+                out.write(json.dumps(record, default=str).encode("utf-8") + b"\n")
+
+            written = out.tell()
+
+        # Move the size, row count and position along together, so they always describe the same file
+        checkpoint.update(bytes=written, rows=checkpoint["rows"] + builder.rows,
+                          pit=self._position(search_pit, page))
+        self._save_checkpoint(checkpoint)
+
+    def _write_parquet_page(self, writer, checkpoint, search_pit, page, builder_args):
+        """Write a page as a row group, starting a new part file when the columns change
+
+        Returns:
+            dict: the open part's ParquetWriter, its path, how many rows it holds, and
+                the position after its last page
+        """
+
+        import pyarrow.parquet as pq
+
+        builder = ColumnBuilder.for_search(**builder_args)
+        builder.add_page(page)
+        table = self._page_table(builder.finish())
+
+        if writer is not None and not table.schema.equals(writer["writer"].schema):
+            conformed = self._conform(table, writer["writer"].schema)
+
+            if conformed is None:
+                self._close_part(writer, checkpoint)
+                writer = None
+            else:
+                table = conformed
+
+        if writer is None:
+            path = os.path.join(self.path, f"part-{len(checkpoint['parts']):05d}.parquet")
+            writer = {"writer": pq.ParquetWriter(path, table.schema), "path": path, "rows": 0,
+                      "pit": dict(checkpoint["pit"])}
+
+        writer["writer"].write_table(table)
+        writer.update(rows=writer["rows"] + table.num_rows, pit=self._position(search_pit, page))
+
+        return writer
+
+    def _close_part(self, writer, checkpoint):
+        """Finish a part file and only then record it, and our position, in the checkpoint"""
+
+        writer["writer"].close()
+        checkpoint["parts"].append(os.path.basename(writer["path"]))
+        checkpoint["rows"] += writer["rows"]
+        checkpoint["bytes"] += os.path.getsize(writer["path"])
+        checkpoint["pit"] = writer["pit"]
+        checkpoint["resume_from"] = dict(writer["pit"])
+        self._save_checkpoint(checkpoint)
+
+    def _position(self, search_pit, page):
+        """Where to pick up from after a page: the search's latest point in time id and the page's last sort"""
+
+        return {"id": search_pit["id"], "search_after": page[-1]["sort"]}
+
+    def _page_table(self, columns):
+        """Build an Arrow table from a page's columns, storing any column Arrow can't type as JSON text"""
+
+        import pyarrow as pa
+
+        arrays = {}
+
+        for name, values in columns.items():
+            try:
+                arrays[name] = pa.array(values)
+
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                arrays[name] = pa.array([None if v is None else json.dumps(v, default=str) for v in values])
+
+        return pa.table(arrays)
+
+    def _conform(self, table, schema):
+        """Fit a page to the current part's schema, or return None if it needs a new part"""
+
+        import pyarrow as pa
+
+        if not set(table.column_names) <= set(schema.names):
+            return None
+
+        columns = []
+
+        for field in schema:
+            if field.name not in table.column_names:
+                columns.append(pa.nulls(table.num_rows, field.type))
+                continue
+
+            try:
+                columns.append(table.column(field.name).cast(field.type))
+
+            except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+                return None
+
+        return pa.table(columns, schema=schema)
+
+    def _remove_incomplete_parts(self, checkpoint):
+        """Drop part files written after the last checkpoint, and rewind to where it left off"""
+
+        for filename in os.listdir(self.path):
+            if filename.startswith("part-") and filename not in checkpoint["parts"]:
+                os.remove(os.path.join(self.path, filename))
+
+        checkpoint["pit"].clear()
+        checkpoint["pit"].update(checkpoint["resume_from"])
+
+    def _signature(self, **kwargs):
+        """Identify the search behind an export, so we never resume someone else's"""
+
+        signature = {key: kwargs.get(key) for key in ("index", "query", "fields", "exclude", "retrieve", "metadata",
+                                                      "time_field", "time_from", "time_to", "score")}
+
+        return sha1(json.dumps(signature, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def _load_checkpoint(self, signature):
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path) as f:
+                checkpoint = json.load(f)
+
+            if checkpoint["signature"] != signature:
+                raise ValueError(f"{self.path} already holds an export of a different search. Remove it or \
+                    choose another --out path")
+
+            return checkpoint
+
+        if os.path.exists(self.path) and (not self.parquet or os.listdir(self.path)):
+            raise ValueError(f"{self.path} already exists and isn't an export we can resume")
+
+        return {"signature": signature, "complete": False, "rows": 0, "bytes": 0, "parts": [],
+                "pit": {}, "resume_from": {}}
+
+    def _save_checkpoint(self, checkpoint):
+        if self.parquet:
+            os.makedirs(self.path, exist_ok=True)
+
+        with open(self.checkpoint_path, "w") as f:
+            json.dump(checkpoint, f)
+
+    def _reset(self):
+        if self.parquet:
+            for filename in os.listdir(self.path):
+                os.remove(os.path.join(self.path, filename))
+        else:
+            for path in (self.path, self.checkpoint_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def _summary(self, checkpoint, elapsed):
+        return {
+            "path": self.path,
+            "format": "parquet" if self.parquet else "ndjson",
+            "rows": checkpoint["rows"],
+            "bytes": checkpoint["bytes"],
+            "elapsed_seconds": round(elapsed, 3),
+            "complete": checkpoint["complete"]
+        }
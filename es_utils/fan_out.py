@@ -0,0 +1,105 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import closing
+from fnmatch import fnmatchcase
+from threading import Event
+
+
+def match_instances(pattern, instances):
+    """Expand a comma separated list of instance names and wildcard patterns, e.g. "us-*,eu-west"
+
+    Returns:
+        list: the matching instance names, in the order they were asked for, without duplicates.
+            Names without wildcards are kept even if there's no such instance, so they can be
+            reported as failures.
+    """
+
+    matched = []
+
+    for name in [part.strip() for part in pattern.split(",") if part.strip()]:
+        if any(char in name for char in "*?["):
+            candidates = [instance for instance in sorted(instances) if fnmatchcase(instance, name)]
+        else:
+            candidates = [name]
+
+        matched.extend(instance for instance in candidates if instance not in matched)
+
+    return matched
+
+
+def is_fan_out(pattern):
+    """Whether an -i value names more than one instance"""
+    return pattern is not None and any(char in pattern for char in ",*?[")
+
+
+def until_stopped(pages, stop):
+    """Stop a stream of pages (and release its point in time or scroll) once stop is set"""
+
+    with closing(pages):
+        for page in pages:
+            if stop.is_set():
+                return
+
+            yield page
+
+
+class FanOut:
+    """Runs the same query on several instances at once, each on its own worker thread
+
+    Every instance gets the same timeout, counted from when they all start, so the whole
+    run takes about as long as the slowest instance (or the timeout), not the sum of them.
+    An instance that fails or runs out of time is reported in failures, and doesn't stop
+    the others.
+    """
+
+    def __init__(self, sessions, timeout=None):
+        self.sessions = sessions
+        self.timeout = timeout
+
+    def run(self, query):
+        """Run query(name, session, stop) for every instance
+
+        A query that streams pages should pass them through until_stopped with its stop
+        Event, so it winds down (and releases its point in time) when it runs out of time.
+
+        Returns:
+            tuple: the results by instance name, the failures (error messages) by instance
+                name, and the seconds each instance took
+        """
+
+        stop = Event()
+        results = {}
+        failures = {}
+        elapsed = {}
+
+        def timed(name, session):
+            started = time.perf_counter()
+
+            try:
+                return query(name, session, stop)
+
+            finally:
+                elapsed[name] = time.perf_counter() - started
+
+        executor = ThreadPoolExecutor(max_workers=max(len(self.sessions), 1), thread_name_prefix="es-fan-out")
+        futures = {executor.submit(timed, name, session): name for name, session in self.sessions.items()}
+
+        try:
+            done, not_done = wait(futures, timeout=self.timeout)
+
+            for future in done:
+                try:
+                    results[futures[future]] = future.result()
+
+                except Exception as e:
+                    failures[futures[future]] = f"{type(e).__name__}: {e}"
+
+            for future in not_done:
+                failures[futures[future]] = f"timed out after {self.timeout:g} seconds"
+                elapsed[futures[future]] = self.timeout
+
+        finally:
+            stop.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        return results, failures, elapsed
@@ -0,0 +1,146 @@
+from contextlib import closing
+from threading import Lock
+
+
+# The sort value Elasticsearch gives a document without the field, when sorting ascending
+MISSING = 2 ** 63 - 1
+
+
+def hit_time(hit):
+    """Read a hit's time field as epoch milliseconds, or None if it doesn't have one
+
+    Incremental searches are sorted on the time field first, as a date (see
+    ElasticAPI._search_body), so its sort value is already epoch millis whatever the
+    field's format or type.
+    """
+
+    values = hit.get("sort") or [None]
+
+    if not isinstance(values[0], (int, float)) or values[0] == MISSING:
+        return None
+
+    return int(values[0])
+
+
+class IncrementalSearch:
+    """The rows a repeated search has returned so far, and how far through time it's gotten
+
+    The high water mark is the newest time field value seen, in epoch milliseconds. Each run
+    only asks for documents at or after it, so the documents sitting exactly on the mark are
+    fetched again; the ids of those are remembered so they're dropped rather than duplicated,
+    while new documents with the same timestamp still get through.
+    """
+
+    def __init__(self):
+        self.frame = None
+        self.times = None
+        self.high_water = None
+        self.edge_ids = set()
+        self.pending = None
+
+    def track(self, pages):
+        """Filter out hits we already have and note the new high water mark, page by page
+
+        Nothing is committed until append is called with the finished DataFrame, so a run
+        that fails part way through leaves the tail as it was.
+
+        Yields:
+            list: each page, without the hits a previous run already returned
+        """
+
+        high_water, edge_ids = self.high_water, self.edge_ids
+        self.pending = {"high_water": high_water, "edge_ids": set(edge_ids), "times": [], "hits": 0}
+
+        with closing(pages):
+            for page in pages:
+                kept = []
+
+                for hit in page:
+                    when = hit_time(hit)
+                    key = (hit.get("_index"), hit.get("_id"))
+
+                    if when is not None and when == high_water and key in edge_ids:
+                        continue
+
+                    if when is not None:
+                        self._advance(when, key)
+
+                    self.pending["times"].append(when)
+                    kept.append(hit)
+
+                self.pending["hits"] += len(page)
+
+                yield kept
+
+    def _advance(self, when, key):
+        pending = self.pending
+
+        if pending["high_water"] is None or when > pending["high_water"]:
+            pending["high_water"] = when
+            pending["edge_ids"] = {key}
+
+        elif when == pending["high_water"]:
+            pending["edge_ids"].add(key)
+
+    def append(self, new_rows, window=None):
+        """Add a run's new rows to the ones we already had, and commit its high water mark
+
+        Args:
+            new_rows (DataFrame): the rows built from the pages that went through track
+            window (int): if set, drop rows more than this many milliseconds older than
+                the high water mark
+
+        Returns:
+            DataFrame: every row the search has returned that's still inside the window
+        """
+
+        import pandas as pd
+
+        times = pd.Series(self.pending["times"], dtype="float64")
+
+        if self.frame is None:
+            frame = new_rows.reset_index(drop=True)
+        else:
+            frame = pd.concat([self.frame, new_rows], ignore_index=True)
+            times = pd.concat([self.times, times], ignore_index=True)
+
+        self.high_water = self.pending["high_water"]
+        self.edge_ids = self.pending["edge_ids"]
+        self.pending = None
+
+        if window and self.high_water is not None:
+            keep = (times >= self.high_water - window).to_numpy()
+            frame = frame[keep].reset_index(drop=True)
+            times = times[keep].reset_index(drop=True)
+
+        self.frame = frame
+        self.times = times
+
+        return frame
+
+
+class IncrementalSearches:
+    """Every incremental search's tail, keyed on the instance and the search it runs"""
+
+    key_fields = ("instance", "index", "query", "time_field", "time_from", "time_to", "fields", "exclude",
+                  "retrieve", "metadata")
+
+    def __init__(self):
+        self.tails = {}
+        self.lock = Lock()
+
+    def make_key(self, **kwargs):
+        return tuple(str(kwargs.get(field)) for field in self.key_fields)
+
+    def get(self, key, reset=False):
+        """Return the tail for a search, starting a new one the first time (or when asked to)"""
+
+        with self.lock:
+            if reset or key not in self.tails:
+                self.tails[key] = IncrementalSearch()
+
+            return self.tails[key]
+
+    def clear(self):
+        with self.lock:
+            self.tails.clear()
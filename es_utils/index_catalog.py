@@ -0,0 +1,105 @@
+import time
+from fnmatch import fnmatchcase
+from threading import Lock, Thread
+
+
+class IndexCatalog:
+    """A cached list of a cluster's indices, with their doc count, size, health and creation date
+
+    The catalog is fetched the first time it's needed and kept for ttl seconds. After that,
+    reads return the cached copy straight away and refresh it in a background thread, so
+    neither get_indices nor tab completion has to wait on the cluster.
+    """
+
+    sort_keys = {
+        "name": (lambda idx: idx["index"], False),
+        "size": (lambda idx: idx["store_bytes"], True),
+        "docs": (lambda idx: idx["docs"], True),
+        "date": (lambda idx: idx["created"], True)
+    }
+
+    def __init__(self, fetch, ttl=300):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.indices = None
+        self.fetched = 0
+        self.lock = Lock()
+        self.refreshing = False
+
+    def get(self, refresh=False):
+        """Return the catalog, fetching it now if we don't have one (or were asked to)
+
+        Returns:
+            list: a dict per index with its name, health, docs, store_bytes and created (epoch millis)
+        """
+
+        if refresh or self.indices is None:
+            self.refresh()
+
+        elif time.time() - self.fetched > self.ttl:
+            self.refresh_in_background()
+
+        return self.indices
+
+    def cached(self):
+        """Return whatever we have without ever waiting on the cluster, starting a refresh if it's stale
+
+        Returns:
+            list: the cached catalog, which is empty until the first fetch finishes
+        """
+
+        if self.indices is None or time.time() - self.fetched > self.ttl:
+            self.refresh_in_background()
+
+        return self.indices or []
+
+    def refresh(self):
+        indices = self.fetch()
+
+        with self.lock:
+            self.indices = indices
+            self.fetched = time.time()
+
+    def refresh_in_background(self):
+        with self.lock:
+            if self.refreshing:
+                return
+
+            self.refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+
+            # A failed background refresh just leaves the old catalog in place until the next try
+            except Exception:
+                pass
+
+            finally:
+                self.refreshing = False
+
+        Thread(target=run, name="es-index-catalog", daemon=True).start()
+
+    def filter(self, indices, pattern=None, sort="name", limit=None):
+        """Narrow down and order a list of indices from the catalog
+
+        Args:
+            indices (list): indices as returned by get or cached
+            pattern (str): a wildcard pattern like "logs-*-2024.*", or a prefix if it has no wildcards
+            sort (str): "name", or "size", "docs" or "date" for the largest/newest first
+            limit (int): only return this many indices
+
+        Returns:
+            list: the matching indices, sorted
+        """
+
+        if pattern:
+            if not any(char in pattern for char in "*?["):
+                pattern += "*"
+
+            indices = [idx for idx in indices if fnmatchcase(idx["index"], pattern)]
+
+        key, reverse = self.sort_keys[sort]
+        indices = sorted(indices, key=key, reverse=reverse)
+
+        return indices[:limit] if limit else indices
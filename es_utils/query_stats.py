@@ -0,0 +1,184 @@
+import json
+import time
+from collections import Counter, deque
+from threading import Lock, get_ident
+
+
+class QueryStats:
+    """Timing and throughput for a single query, filled in as it runs
+
+    ElasticAPI calls add_response for every request it makes, and the integration times
+    the parse and frame-building stages around it. Where the time went is broken down into:
+
+    * took_ms: what the cluster reported spending on the requests
+    * transport_seconds: time on the wire, the node's request duration minus took
+    * decode_seconds: time decoding JSON, the client call's duration minus the node's
+    * parse_seconds: time in ResponseParser, not counting the time it spent waiting for
+      responses: its own requests, or pages from slices fetched on other threads. When
+      several threads parse (one per instance for a fan-out), it's their total
+    * frame_seconds: time building the DataFrame
+    * first_page_seconds: from the start of the query until its first response arrived,
+      how long before there's anything to show
+
+    For --typed results, untyped_frame_bytes and frame_bytes record the DataFrame's memory
+    before and after its dtypes were picked from the mapping. max_bytes_reached is set when a
+    search stopped early because its hits came to es_max_bytes.
+    """
+
+    def __init__(self, instance, command, index=None, query=None):
+        self.lock = Lock()
+        self.started = time.perf_counter()
+        self.waited = Counter()
+        self.parsers = set()
+        self.record = {
+            "timestamp": time.time(),
+            "instance": instance,
+            "command": command,
+            "index": index,
+            "query": query,
+            "pages": 0,
+            "hits": 0,
+            "bytes": 0,
+            "took_ms": 0,
+            "request_seconds": 0.0,
+            "transport_seconds": 0.0,
+            "decode_seconds": 0.0,
+            "parse_seconds": 0.0,
+            "frame_seconds": 0.0,
+            "first_page_seconds": None,
+            "untyped_frame_bytes": 0,
+            "frame_bytes": 0,
+            "max_bytes_reached": False,
+            "total_seconds": 0.0,
+            "hits_per_second": 0.0
+        }
+
+    def add_response(self, response, elapsed, response_bytes=0, page=True):
+        """Record one request to the cluster
+
+        Args:
+            response (ObjectApiResponse or dict): what the client returned
+            elapsed (float): how long the client call took, in seconds
+            response_bytes (int): the size of the response body, when it's known
+            page (bool): whether it brought back results, rather than e.g. opening a point
+                in time, which doesn't count towards pages or first_page_seconds
+        """
+
+        body = getattr(response, "body", response)
+        took = body.get("took", 0) if isinstance(body, dict) else 0
+        meta = getattr(response, "meta", None)
+        duration = getattr(meta, "duration", elapsed) if meta is not None else elapsed
+
+        with self.lock:
+            self.waited[get_ident()] += elapsed
+
+            if page and self.record["first_page_seconds"] is None:
+                self.record["first_page_seconds"] = time.perf_counter() - self.started
+
+            self.record["pages"] += int(page)
+            self.record["bytes"] += response_bytes
+            self.record["took_ms"] += took
+            self.record["request_seconds"] += elapsed
+            self.record["transport_seconds"] += max(duration - took / 1000, 0.0)
+            self.record["decode_seconds"] += max(elapsed - duration, 0.0)
+
+    def reached_max_bytes(self):
+        """Note that the search stopped early, because its hits came to es_max_bytes"""
+
+        with self.lock:
+            self.record["max_bytes_reached"] = True
+
+    def add_wait(self, elapsed):
+        """Record time this thread spent waiting for pages fetched on another thread"""
+
+        with self.lock:
+            self.waited[get_ident()] += elapsed
+
+    def add_stage(self, stage, elapsed):
+        """Add time spent in one of our own stages, "parse" or "frame", by this thread"""
+
+        with self.lock:
+            self.record[f"{stage}_seconds"] += elapsed
+
+            if stage == "parse":
+                self.parsers.add(get_ident())
+
+    def add_memory(self, untyped_bytes, typed_bytes):
+        """Record the DataFrame's memory before and after it was typed"""
+
+        with self.lock:
+            self.record["untyped_frame_bytes"] = untyped_bytes
+            self.record["frame_bytes"] = typed_bytes
+
+    def finish(self, hits):
+        """Close out the record once the results are ready
+
+        Returns:
+            dict: the finished record
+        """
+
+        total = time.perf_counter() - self.started
+
+        with self.lock:
+            # Waiting on responses while parsing a stream of pages shouldn't count as parsing. Slices
+            # wait on other threads, so only the waits of the threads that did the parsing are taken off
+            waited = sum(self.waited[thread] for thread in self.parsers)
+            self.record["parse_seconds"] = max(self.record["parse_seconds"] - waited, 0.0)
+            self.record["hits"] = hits
+            self.record["total_seconds"] = total
+            self.record["hits_per_second"] = hits / total if total > 0 else 0.0
+
+            return dict(self.record)
+
+
+class StatsHistory:
+    """Keeps the most recent QueryStats records for each instance
+
+    If export_path is set, every finished record is also appended there as a line of JSON.
+    """
+
+    def __init__(self, max_records=100, export_path=None):
+        self.max_records = max_records
+        self.export_path = export_path
+        self.records = {}
+        self.lock = Lock()
+
+    def add(self, record):
+        with self.lock:
+            if record["instance"] not in self.records:
+                self.records[record["instance"]] = deque(maxlen=self.max_records)
+
+            self.records[record["instance"]].append(record)
+
+            if self.export_path:
+                with open(self.export_path, "a") as f:
+                    f.write(json.dumps(record, default=str) + "\n")
+
+    def clear(self):
+        with self.lock:
+            self.records.clear()
+
+    def describe(self, instance=None):
+        """Summarize the history as Markdown, one table per instance"""
+
+        instances = [instance] if instance is not None else sorted(self.records)
+        description = ""
+
+        for name in instances:
+            rows = "".join(
+                f"| {time.strftime('%H:%M:%S', time.localtime(r['timestamp']))} | {r['command']} | {r['index']} "
+                f"| {r['pages']} | {r['hits']} | {r['bytes']} | {r['took_ms']} | {r['transport_seconds']:.3f} "
+                f"| {r['decode_seconds']:.3f} | {r['parse_seconds']:.3f} | {r['frame_seconds']:.3f} "
+                f"| {r['total_seconds']:.3f} | {r['hits_per_second']:.0f} |\n"
+                for r in self.records.get(name, [])
+            )
+
+            description += (f"#### Query stats for `{name}`\n"
+                            "***\n"
+                            "| Time | Command | Index | Pages | Hits | Bytes | Took (ms) | Transport (s) "
+                            "| Decode (s) | Parse (s) | Frame (s) | Total (s) | Hits/s |\n"
+                            "| ---- | ------- | ----- | ----- | ---- | ----- | --------- | ------------- "
+                            "| ---------- | --------- | --------- | --------- | ------ |\n"
+                            f"{rows}\n")
+
+        return description or "No query stats recorded yet"
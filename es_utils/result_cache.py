@@ -0,0 +1,194 @@
+import json
+import os
+import time
+from collections import OrderedDict
+from hashlib import sha1
+
+
+class ResultCache:
+    """An in-memory LRU cache of search results, with an optional on-disk spill
+
+    Entries expire after ttl seconds, and the least recently used entries are evicted
+    once the cached DataFrames go over max_bytes. If spill_dir is set, evicted entries
+    are written there as Parquet files and read back on a later hit.
+    """
+
+    # The parsed input keys that change what a search returns
+    key_fields = ["command", "instance", "index", "query", "fields", "exclude", "retrieve", "metadata",
+                  "group_by", "metric", "composite", "typed", "time_field", "time_from", "time_to", "score",
+                  "es_score", "es_max_results", "es_max_bytes"]
+
+    def __init__(self, max_bytes, ttl, spill_dir=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.spill_dir = spill_dir
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def make_key(self, **kwargs):
+        """Build a cache key from the user's parsed input
+
+        Returns:
+            str: a stable hash of the inputs listed in key_fields
+        """
+
+        key_inputs = {field: kwargs.get(field) for field in self.key_fields}
+
+        return sha1(json.dumps(key_inputs, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Look up a cached DataFrame, checking memory first and then the spill directory
+
+        Returns:
+            DataFrame or None: a copy of the cached results, or None on a miss
+        """
+
+        entry = self.entries.get(key)
+
+        if entry is not None and self._expired(entry["created"]):
+            self._remove(key)
+            entry = None
+
+        if entry is None:
+            entry = self._read_spill(key)
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+
+        # Hand back a copy so changes made in the notebook don't leak into the cache
+        return entry["dataframe"].copy()
+
+    def put(self, key, dataframe, **kwargs):
+        """Cache a DataFrame, evicting least recently used entries to stay within max_bytes"""
+
+        size = int(dataframe.memory_usage(index=True, deep=True).sum())
+
+        if size > self.max_bytes:
+            return
+
+        if key in self.entries:
+            self._remove(key)
+
+        self.entries[key] = {
+            "created": time.time(),
+            "bytes": size,
+            "dataframe": dataframe.copy(),
+            "instance": kwargs.get("instance"),
+            "index": kwargs.get("index"),
+            "query": kwargs.get("query")
+        }
+        self.total_bytes += size
+        self._evict()
+
+    def clear(self):
+        """Drop every entry from memory and from the spill directory
+
+        Returns:
+            int: how many entries were removed
+        """
+
+        removed = len(self.entries)
+        self.entries.clear()
+        self.total_bytes = 0
+
+        if self.spill_dir and os.path.isdir(self.spill_dir):
+            for filename in os.listdir(self.spill_dir):
+                if filename.endswith(".parquet"):
+                    os.remove(os.path.join(self.spill_dir, filename))
+                    removed += 1
+
+        return removed
+
+    def _expired(self, created):
+        return time.time() - created > self.ttl
+
+    def _remove(self, key):
+        entry = self.entries.pop(key)
+        self.total_bytes -= entry["bytes"]
+
+    def _evict(self):
+        """Spill least recently used entries until we're back under max_bytes, keeping the newest"""
+
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            evicted_key, evicted = next(iter(self.entries.items()))
+            self._remove(evicted_key)
+            self._write_spill(evicted_key, evicted)
+
+    def _spill_path(self, key):
+        return os.path.join(self.spill_dir, f"{key}.parquet")
+
+    def _write_spill(self, key, entry):
+        if not self.spill_dir or self._expired(entry["created"]):
+            return
+
+        try:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            entry["dataframe"].to_parquet(self._spill_path(key))
+            os.utime(self._spill_path(key), (entry["created"], entry["created"]))
+
+        # Parquet needs pyarrow and can't store every mix of Python objects, in which case
+        # the entry is simply dropped like it would be without a spill directory
+        except Exception:
+            if os.path.exists(self._spill_path(key)):
+                os.remove(self._spill_path(key))
+
+    def _read_spill(self, key):
+        if not self.spill_dir or not os.path.exists(self._spill_path(key)):
+            return None
+
+        path = self._spill_path(key)
+        created = os.path.getmtime(path)
+
+        if self._expired(created):
+            os.remove(path)
+            return None
+
+        try:
+            import pandas as pd
+
+            dataframe = pd.read_parquet(path)
+
+        except Exception:
+            return None
+
+        os.remove(path)
+        size = int(dataframe.memory_usage(index=True, deep=True).sum())
+        entry = {"created": created, "bytes": size, "dataframe": dataframe,
+                 "instance": None, "index": None, "query": None}
+        self.entries[key] = entry
+        self.total_bytes += size
+        self._evict()
+
+        return entry
+
+    def describe(self):
+        """Summarize the cache as Markdown for the `cache` line magic"""
+
+        spilled = 0
+
+        if self.spill_dir and os.path.isdir(self.spill_dir):
+            spilled = len([f for f in os.listdir(self.spill_dir) if f.endswith(".parquet")])
+
+        rows = "".join(
+            f"| {entry['instance']} | {entry['index']} | `{entry['query']}` | {len(entry['dataframe'])} "
+            f"| {entry['bytes']} | {int(time.time() - entry['created'])} |\n"
+            for entry in reversed(self.entries.values())
+        )
+
+        description = (f"#### Query result cache\n"
+                       "***\n"
+                       f"* **In memory:** {len(self.entries)} entries, {self.total_bytes} of {self.max_bytes} bytes\n"
+                       f"* **Spilled to disk:** {spilled} entries in `{self.spill_dir or 'disabled'}`\n"
+                       f"* **Hits / misses:** {self.hits} / {self.misses}\n"
+                       f"* **TTL:** {self.ttl} seconds\n\n"
+                       "| Instance | Index | Query | Rows | Bytes | Age (s) |\n"
+                       "| -------- | ----- | ----- | ---- | ----- | ------- |\n"
+                       f"{rows}")
+
+        return description
@@ -0,0 +1,165 @@
+from importlib import import_module
+from importlib.util import find_spec
+
+
+def parse_bool(value):
+    """Instance options arrive as strings, so accept the usual spellings of true and false"""
+
+    if isinstance(value, bool):
+        return value
+
+    if str(value).strip().lower() in ("1", "true", "yes", "on"):
+        return True
+
+    if str(value).strip().lower() in ("0", "false", "no", "off"):
+        return False
+
+    raise ValueError(f"expected true or false, got '{value}'")
+
+
+def parse_count(minimum):
+    """Build a parser for a whole number option that must be at least minimum"""
+
+    def parse(value):
+        count = int(value)
+
+        if count < minimum:
+            raise ValueError(f"must be at least {minimum}, got {count}")
+
+        return count
+
+    return parse
+
+
+def parse_seconds(value):
+    seconds = float(value)
+
+    if seconds < 0:
+        raise ValueError(f"must not be negative, got {seconds}")
+
+    return seconds
+
+
+def parse_serializer(value):
+    """Either the client's own "json" serializer, or "orjson" if it's installed"""
+
+    if value not in ("json", "orjson"):
+        raise ValueError(f"expected json or orjson, got '{value}'")
+
+    if value == "orjson" and find_spec("orjson") is None:
+        raise ValueError("orjson isn't installed, pip install orjson to use it")
+
+    # elastic_transport only has an orjson serializer from 8.13 on (and only when orjson is installed)
+    if value == "orjson" and not hasattr(import_module("elastic_transport"), "OrjsonSerializer"):
+        raise ValueError("orjson needs elastic_transport 8.13 or later, pip install -U elastic_transport")
+
+    return value
+
+
+# option name -> (parser, default, help)
+TRANSPORT_OPTIONS = {
+    "pool_size": (parse_count(1), 10, "Connections kept alive per node, raise it for --slices above 10"),
+    "compress": (parse_bool, False, "gzip request bodies and ask for gzipped responses"),
+    "retries": (parse_count(0), 3, "How many times to retry a request that failed with 429 or 503, or a \
+        connection error"),
+    "retry_backoff": (parse_seconds, 0.5, "Seconds to wait before the first retry of a 429 or 503, doubling \
+        each time"),
+    "sniff": (parse_bool, False, "Discover the cluster's other nodes on start and when a node fails"),
+    "request_timeout": (parse_seconds, 30.0, "Seconds to wait for a response before giving up"),
+    "serializer": (parse_serializer, "json", "Decode responses with the standard library's json, or the much \
+        faster orjson (which must be installed)")
+}
+
+
+def parse_transport_options(options):
+    """Split an instance's transport tuning options from the rest of its options, and validate them
+
+    Args:
+        options (dict): the instance's options, as strings from its connection definition
+
+    Returns:
+        tuple: the validated transport options (with defaults filled in), and every other option
+
+    Raises:
+        ValueError: if a transport option has a value we can't use
+    """
+
+    transport = {}
+    remaining = dict(options)
+
+    for name, (parse, default, _) in TRANSPORT_OPTIONS.items():
+        if name not in remaining:
+            transport[name] = default
+            continue
+
+        try:
+            transport[name] = parse(remaining.pop(name))
+
+        except ValueError as e:
+            raise ValueError(f"Invalid value for the {name} option: {e}")
+
+    return transport, remaining
+
+
+def client_options(transport):
+    """Turn validated transport options into Elasticsearch client settings
+
+    Retries on 429 and 503 are left to ElasticAPI, so they can back off first; the
+    client itself only retries connection errors and the other gateway errors. The
+    serializers are built by make_serializer and make_arrow_serializer when the client is.
+    """
+
+    client = {
+        "connections_per_node": transport["pool_size"],
+        "http_compress": transport["compress"],
+        "max_retries": transport["retries"],
+        "retry_on_status": (502, 504),
+        "request_timeout": transport["request_timeout"]
+    }
+
+    if transport["sniff"]:
+        client.update({
+            "sniff_on_start": True,
+            "sniff_on_node_failure": True,
+            "min_delay_between_sniffing": 60
+        })
+
+    return client
+
+
+def make_serializer(name):
+    """Build the client's JSON serializer for the serializer option, or None to keep the client's own"""
+
+    if name != "orjson":
+        return None
+
+    from elastic_transport import OrjsonSerializer
+
+    return OrjsonSerializer()
+
+
+ARROW_MIMETYPE = "application/vnd.apache.arrow.stream"
+
+
+def make_arrow_serializer():
+    """Build a serializer that reads Apache Arrow responses (e.g. ES|QL with format=arrow) into a pyarrow Table"""
+
+    from elastic_transport import SerializationError, Serializer
+
+    class ArrowSerializer(Serializer):
+        mimetype = ARROW_MIMETYPE
+
+        def loads(self, data):
+            import pyarrow as pa
+
+            try:
+                with pa.ipc.open_stream(data) as reader:
+                    return reader.read_all()
+
+            except pa.ArrowInvalid as e:
+                raise SerializationError(message="Unable to deserialize as Arrow", errors=(e,))
+
+        def dumps(self, data):
+            raise SerializationError(message="Arrow request bodies aren't supported")
+
+    return ArrowSerializer()
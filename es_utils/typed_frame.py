@@ -0,0 +1,137 @@
+DATE_TYPES = {"date", "date_nanos"}
+INTEGER_TYPES = {"long", "integer", "short", "byte", "unsigned_long"}
+FLOAT32_TYPES = {"float", "half_float"}
+FLOAT64_TYPES = {"double", "scaled_float"}
+KEYWORD_TYPES = {"keyword", "constant_keyword", "ip", "version"}
+TEXT_TYPES = {"text", "match_only_text", "wildcard"}
+
+# Columns the integration adds itself, typed as if they were mapped
+METADATA_TYPES = {"_index": "keyword", "_query": "keyword", "_id": "text"}
+
+
+def flatten_mapping(response):
+    """Flatten a get_mapping response into the Elasticsearch type of each dotted field name
+
+    Multi-fields (e.g. "message.keyword") are included. When several indices map a field
+    differently, its type is None, so it's left for pandas to work out.
+
+    Returns:
+        dict: field name -> Elasticsearch type
+    """
+
+    field_types = {}
+
+    def walk(properties, prefix):
+        for name, mapping in properties.items():
+            field = prefix + name
+
+            if "properties" in mapping:
+                walk(mapping["properties"], field + ".")
+                continue
+
+            es_type = mapping.get("type")
+
+            if field in field_types and field_types[field] != es_type:
+                es_type = None
+
+            field_types[field] = es_type
+            walk(mapping.get("fields", {}), field + ".")
+
+    for index_mapping in response.values():
+        walk(index_mapping.get("mappings", {}).get("properties", {}), "")
+
+    return field_types
+
+
+def apply_types(frame, field_types, category_ratio=0.5):
+    """Give a DataFrame's columns compact dtypes, based on the Elasticsearch types of their fields
+
+    * date and date_nanos become datetime64 (UTC)
+    * keyword fields become categoricals when at most category_ratio of their values are
+      distinct, and Arrow-backed strings otherwise, as do text fields
+    * whole numbers are downcast to the smallest integer type that holds them (a nullable
+      one if the column has gaps), and float fields to float32
+    * booleans become the nullable boolean type
+
+    Columns of unmapped fields, multi-valued fields, or values that don't convert cleanly
+    are left as they are.
+
+    Returns:
+        DataFrame: the typed frame, sharing any unconverted columns with the original
+    """
+
+    frame = frame.copy(deep=False)
+
+    for name in frame.columns:
+        es_type = METADATA_TYPES.get(name) or field_types.get(name)
+
+        if es_type is None or _has_collections(frame[name]):
+            continue
+
+        try:
+            frame[name] = _convert(frame[name], es_type, category_ratio)
+
+        except (TypeError, ValueError, OverflowError, ImportError):
+            pass
+
+    return frame
+
+
+def _has_collections(series):
+    return series.dtype == object and any(isinstance(value, (list, dict)) for value in series)
+
+
+def _convert(series, es_type, category_ratio):
+    import pandas as pd
+
+    if es_type in DATE_TYPES:
+        if pd.api.types.is_numeric_dtype(series):
+            return pd.to_datetime(series, unit="ms", utc=True)
+
+        try:
+            return pd.to_datetime(series, utc=True, format="ISO8601")
+
+        # pandas before 2.0 has no ISO8601 format, but parses it fastest without one
+        except ValueError:
+            return pd.to_datetime(series, utc=True)
+
+    if es_type in INTEGER_TYPES:
+        return _downcast_integers(pd.to_numeric(series))
+
+    if es_type in FLOAT32_TYPES:
+        return pd.to_numeric(series, downcast="float")
+
+    if es_type in FLOAT64_TYPES:
+        return pd.to_numeric(series)
+
+    if es_type == "boolean":
+        return series.astype("boolean")
+
+    if es_type in KEYWORD_TYPES:
+        if series.nunique() <= category_ratio * len(series):
+            return series.astype("category")
+
+        return series.astype("string[pyarrow]")
+
+    if es_type in TEXT_TYPES:
+        return series.astype("string[pyarrow]")
+
+    return series
+
+
+def _downcast_integers(numbers):
+    """Use the smallest integer type that fits, nullable if there are gaps"""
+
+    import numpy as np
+    import pandas as pd
+
+    if not numbers.isna().any():
+        return pd.to_numeric(numbers, downcast="integer")
+
+    low, high = numbers.min(), numbers.max()
+
+    for dtype in ("int8", "int16", "int32", "int64"):
+        if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max:
+            return numbers.astype(dtype.capitalize())
+
+    return numbers
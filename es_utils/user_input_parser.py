@@ -1,9 +1,71 @@
-from argparse import ArgumentParser
+from argparse import ArgumentParser, ArgumentTypeError
 from es_utils.es_api import ElasticAPI
 
 
+def comma_list(value):
+    """argparse type for options that take a comma separated list, like --fields"""
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def group_spec(value):
+    """argparse type for aggregate --group-by, e.g. "terms:host.name:50" or "date_histogram:@timestamp:1h"
+
+    Returns:
+        dict: the aggregation type, field, and its size or interval
+    """
+
+    parts = value.split(":")
+
+    if parts[0] == "terms" and len(parts) in (2, 3):
+        return {"type": "terms", "field": parts[1], "size": int(parts[2]) if len(parts) == 3 else 100}
+
+    if parts[0] == "date_histogram" and len(parts) == 3:
+        return {"type": "date_histogram", "field": parts[1], "interval": parts[2]}
+
+    raise ArgumentTypeError(f"invalid group by '{value}', expected terms:field[:size] or \
+date_histogram:field:interval")
+
+
+def metric_spec(value):
+    """argparse type for aggregate --metric, e.g. "cardinality:user.name" or "percentiles:duration:50,95,99"
+
+    Returns:
+        dict: the metric type, field, and the percents for percentiles
+    """
+
+    parts = value.split(":")
+
+    if parts[0] == "percentiles" and len(parts) in (2, 3):
+        percents = [float(p) for p in comma_list(parts[2])] if len(parts) == 3 else [50.0, 95.0, 99.0]
+        return {"type": "percentiles", "field": parts[1], "percents": percents}
+
+    if parts[0] in ("cardinality", "avg", "sum", "min", "max", "value_count") and len(parts) == 2:
+        return {"type": parts[0], "field": parts[1]}
+
+    raise ArgumentTypeError(f"invalid metric '{value}', expected cardinality, avg, sum, min, max, \
+value_count or percentiles, followed by :field")
+
+
+def duration(value):
+    """argparse type for lengths of time like "30s", "15m", "24h" or "7d"
+
+    Returns:
+        int: the length in milliseconds
+    """
+
+    units = {"s": 1000, "m": 60_000, "h": 3_600_000, "d": 86_400_000}
+
+    if value[-1:] in units and value[:-1].isdigit():
+        return int(value[:-1]) * units[value[-1]]
+
+    raise ArgumentTypeError(f"invalid duration '{value}', expected a number followed by s, m, h or d")
+
+
 class UserInputParser(ArgumentParser):
 
+    # Cell commands whose query can run over more than one line
+    multi_line_commands = (["msearch"], ["esql"], ["sql"])
+
     def __init__(self, *args, **kwargs):
         self.valid_commands = list(filter(lambda func: not func.startswith("_") and
                                           hasattr(getattr(ElasticAPI, func), "__call__"), dir(ElasticAPI)))
@@ -20,15 +82,181 @@ class UserInputParser(ArgumentParser):
             of indices in the cluster")
         self.parser_get_indices.add_argument("-i", "--instance", required=True, help="The name of the \
             Elasticsearch instance (defined in Jupyter) to use")
+        self.parser_get_indices.add_argument("-p", "--pattern", help="Only list indices matching this \
+            wildcard pattern, or starting with it if it has no wildcards")
+        self.parser_get_indices.add_argument("-s", "--sort", choices=["name", "size", "docs", "date"],
+                                             default="name", help="Sort by name (default), or largest/newest first")
+        self.parser_get_indices.add_argument("-n", "--limit", type=int, help="Only list this many indices")
+        self.parser_get_indices.add_argument("-r", "--refresh", action="store_true", help="Fetch the list of \
+            indices from the cluster again instead of using the cached one")
+
+        # Subparser for "cache"
+        self.parser_cache = self.line_subparsers.add_parser("cache", help="Show or clear the cache of \
+            search results")
+        self.parser_cache.add_argument("action", nargs="?", choices=["show", "clear"], default="show",
+                                       help="Show what's cached (default) or clear it")
+
+        # Subparser for "stats"
+        self.parser_stats = self.line_subparsers.add_parser("stats", help="Show the timing breakdown of \
+            recent queries")
+        self.parser_stats.add_argument("action", nargs="?", choices=["show", "clear"], default="show",
+                                       help="Show the stats (default) or clear them")
+        self.parser_stats.add_argument("-i", "--instance", help="Only show the stats for this instance")
+
+        # Subparser for "background"
+        self.parser_background = self.line_subparsers.add_parser("background", help="List, wait for, \
+            or cancel searches running in the background")
+        self.parser_background.add_argument("action", nargs="?", choices=["list", "await", "cancel"],
+                                            default="list", help="List background searches (default), \
+            wait for one to finish, or cancel one")
+        self.parser_background.add_argument("name", nargs="?", help="The name of the background search \
+            to wait for or cancel")
 
         # CELL SUBPARSERS #
         # Subparser for "search"
         self.parser_search = self.cell_subparsers.add_parser("search", help="Perform a search against \
             an index in Elasticsearch")
         self.parser_search.add_argument("-i", "--instance", required=True, help="The name of the \
-            Elasticsearch instance (defined in Jupyter) to use")
+            Elasticsearch instance (defined in Jupyter) to use, or a comma separated list or wildcard \
+            pattern of instances (e.g. us-*,eu-west) to run it on all at once")
         self.parser_search.add_argument("-d", "--index", required=True, help="The name of the index in \
             the Elasticsearch cluster to search")
+        self.parser_search.add_argument("-p", "--paginate", choices=["pit", "scroll"], default="pit",
+                                        help="How to page through results: a point in time with \
+            search_after (default), or the scroll API for older clusters")
+        self.parser_search.add_argument("-s", "--slices", type=int, default=1, help="Split the search \
+            into this many slices and retrieve them concurrently (default: 1)")
+        self.parser_search.add_argument("-m", "--metadata", action="store_true", help="Keep each hit's \
+            _id and _index as columns in the results")
+        self.parser_search.add_argument("-f", "--fields", type=comma_list, help="A comma separated list \
+            of fields (wildcards allowed) to return, in the order you want the columns")
+        self.parser_search.add_argument("-x", "--exclude", type=comma_list, help="A comma separated list \
+            of fields (wildcards allowed) to leave out of the results")
+        self.parser_search.add_argument("-r", "--retrieve", choices=["source", "fields", "docvalues"],
+                                        default="source", help="Where the cluster reads the returned fields \
+            from: a filtered _source (default), the fields API, or docvalue_fields")
+        self.parser_search.add_argument("-c", "--cache", choices=["use", "refresh", "bypass"], default="use",
+                                        help="Return cached results when there are some (default), re-run \
+            the search and refresh the cache, or bypass the cache entirely")
+        self.parser_search.add_argument("-b", "--background", nargs="?", const="", metavar="NAME",
+                                        help="Run the search in the background and return right away. \
+            The results are stored in a variable called NAME (or es_bg_N when not given)")
+        self.parser_search.add_argument("-o", "--out", metavar="PATH", help="Stream every matching hit \
+            to PATH (.parquet or .ndjson) instead of returning a DataFrame, ignoring es_max_results. Running \
+            the same cell again resumes an interrupted export")
+        self.parser_search.add_argument("-t", "--typed", action="store_true", help="Pick each column's \
+            dtype from the index mapping (datetimes, categoricals, downcast numbers, Arrow strings) to use \
+            less memory")
+        self.parser_search.add_argument("--incremental", action="store_true", help="Only fetch documents \
+            newer than the last time this search ran, and add them to the results it returned then. Use \
+            -c refresh to start over")
+        self.parser_search.add_argument("--from", dest="time_from", metavar="TIME", help="Only match \
+            documents with a time field at or after TIME, a date or date math (e.g. now-1h or 2024-05-01)")
+        self.parser_search.add_argument("--to", dest="time_to", metavar="TIME", help="Only match documents \
+            with a time field at or before TIME, a date or date math (e.g. now or 2024-05-31)")
+        self.parser_search.add_argument("--time-field", dest="time_field", default="@timestamp",
+                                        help="The date field --from, --to and --incremental use \
+            (default: @timestamp)")
+        self.parser_search.add_argument("--window", type=duration, metavar="DURATION", help="With \
+            --incremental, drop rows older than this (e.g. 24h) relative to the newest document")
+        self.search_look = self.parser_search.add_mutually_exclusive_group()
+        self.search_look.add_argument("--sample", type=int, metavar="N", help="Return a random sample of N \
+            matching documents in one request, with the exact number of matches from a _count")
+        self.search_look.add_argument("--preview", type=int, nargs="?", const=100, metavar="N", help="Return \
+            the first N (default: 100) matching documents in one request, with an estimate of how many match")
+        self.parser_search.add_argument("--profile", nargs="?", const="es_profile", metavar="NAME",
+                                        help="Profile the first page of the search on the cluster and show \
+            its most expensive clauses and shards. The per-shard, per-clause timings are stored in a variable \
+            called NAME (or es_profile when not given)")
+        self.parser_search.add_argument("--seed", type=int, help="With --sample, the random seed, so the \
+            same sample comes back every time")
+        self.search_scoring = self.parser_search.add_mutually_exclusive_group()
+        self.search_scoring.add_argument("--score", dest="score", action="store_const", const=True,
+                                         help="Score the hits, even if es_score is False")
+        self.search_scoring.add_argument("--no-score", dest="score", action="store_const", const=False,
+                                         help="Don't score the hits, which is cheaper for bulk pulls: the \
+            query runs in filter context, sorted on _doc, without counting every match. The default when \
+            es_score is False")
+
+        # Subparser for "aggregate"
+        self.parser_aggregate = self.cell_subparsers.add_parser("aggregate", help="Run an aggregation \
+            against an index in Elasticsearch and return the buckets as a table")
+        self.parser_aggregate.add_argument("-i", "--instance", required=True, help="The name of the \
+            Elasticsearch instance (defined in Jupyter) to use, or a comma separated list or wildcard \
+            pattern of instances (e.g. us-*,eu-west) to run it on all at once")
+        self.parser_aggregate.add_argument("-d", "--index", required=True, help="The name of the index in \
+            the Elasticsearch cluster to aggregate")
+        self.parser_aggregate.add_argument("-g", "--group-by", dest="group_by", type=group_spec, action="append",
+                                           default=[], help="A bucket to group by, either terms:field[:size] \
+            or date_histogram:field:interval. Repeat it to nest buckets, outermost first")
+        self.parser_aggregate.add_argument("-m", "--metric", type=metric_spec, action="append", default=[],
+                                           help="A metric to calculate for each bucket: cardinality, avg, sum, \
+            min, max or value_count followed by :field, or percentiles:field[:50,95,99]. Can be repeated")
+        self.parser_aggregate.add_argument("--composite", action="store_true", help="Page through every \
+            bucket with a composite aggregation, for high cardinality fields (up to es_max_results rows)")
+        self.parser_aggregate.add_argument("-c", "--cache", choices=["use", "refresh", "bypass"], default="use",
+                                           help="Return cached results when there are some (default), re-run \
+            the aggregation and refresh the cache, or bypass the cache entirely")
+
+        # Subparser for "msearch"
+        self.parser_msearch = self.cell_subparsers.add_parser("msearch", help="Run several searches, one \
+            per line, in a single request to Elasticsearch")
+        self.parser_msearch.add_argument("-i", "--instance", required=True, help="The name of the \
+            Elasticsearch instance (defined in Jupyter) to use, or a comma separated list or wildcard \
+            pattern of instances (e.g. us-*,eu-west) to run it on all at once")
+        self.parser_msearch.add_argument("-d", "--index", required=True, help="The name of the index in \
+            the Elasticsearch cluster to search, unless a query line starts with @index to override it")
+        self.parser_msearch.add_argument("-m", "--metadata", action="store_true", help="Keep each hit's \
+            _id and _index as columns in the results")
+        self.parser_msearch.add_argument("-f", "--fields", type=comma_list, help="A comma separated list \
+            of fields (wildcards allowed) to return, in the order you want the columns")
+        self.parser_msearch.add_argument("-x", "--exclude", type=comma_list, help="A comma separated list \
+            of fields (wildcards allowed) to leave out of the results")
+        self.parser_msearch.add_argument("-t", "--typed", action="store_true", help="Pick each column's \
+            dtype from the index mapping to use less memory")
+        self.parser_msearch.add_argument("--split", metavar="NAME", help="Also store a dict of one DataFrame \
+            per query (keyed q1, q2, ...) in a variable called NAME")
+        self.parser_msearch.add_argument("-c", "--cache", choices=["use", "refresh", "bypass"], default="use",
+                                         help="Return cached results when there are some (default), re-run \
+            the searches and refresh the cache, or bypass the cache entirely")
+
+        # Subparsers for "esql" and "sql"
+        self.parser_esql = self.cell_subparsers.add_parser("esql", help="Run an ES|QL query, with the \
+            results sent as Apache Arrow columns")
+        self.parser_sql = self.cell_subparsers.add_parser("sql", help="Run an SQL query, paging through \
+            the results a column at a time with a cursor")
+
+        for parser in (self.parser_esql, self.parser_sql):
+            parser.add_argument("-i", "--instance", required=True, help="The name of the Elasticsearch \
+                instance (defined in Jupyter) to use, or a comma separated list or wildcard pattern of \
+                instances (e.g. us-*,eu-west) to run it on all at once")
+            parser.add_argument("-t", "--typed", action="store_true", help="Pick each column's dtype from \
+                the types the cluster sends with the results (categoricals, datetimes, downcast numbers)")
+            parser.add_argument("-c", "--cache", choices=["use", "refresh", "bypass"], default="use",
+                                help="Return cached results when there are some (default), re-run the \
+                query and refresh the cache, or bypass the cache entirely")
+
+    def _check_combinations(self, command):
+        """Refuse options that parse fine on their own but can't be used together
+
+        The problem is reported the way argparse reports any other, with the command's usage.
+        """
+
+        if command.command == "search" and command.exclude and command.retrieve != "source":
+            self.parser_search.error(f"-x/--exclude only filters _source, so it can't be used with \
+-r {command.retrieve}. List the fields you want with -f instead")
+
+        if command.command == "search" and command.profile is not None:
+            # These run their own searches, which are never profiled
+            other_modes = {"out": "-o/--out", "incremental": "--incremental", "sample": "--sample",
+                           "preview": "--preview", "background": "-b/--background"}
+            used = [flag for option, flag in other_modes.items() if getattr(command, option) not in (None, False)]
+
+            if used:
+                self.parser_search.error(f"--profile can't be used with {', '.join(used)}")
+
+        if command.command == "aggregate" and command.composite and not command.group_by:
+            self.parser_aggregate.error("--composite pages through buckets, so it needs at least one -g/--group-by")
 
     def display_help(self, command):
         self.parser.parse_args([command], "--help")
@@ -66,6 +294,8 @@ class UserInputParser(ArgumentParser):
                 else:
                     parsed_user_command = self.line_parser.parse_args(input.split())
                     parsed_input["input"].update(vars(parsed_user_command))
+                    # add the **kwargs ("search_opts" from es_full)
+                    parsed_input["input"].update(kwargs)
 
             except SystemExit:
                 parsed_input["error"] = True
@@ -81,15 +311,25 @@ class UserInputParser(ArgumentParser):
             try:
                 if len(split_user_input) == 1:
                     parsed_user_command = self.cell_parser.parse_args(split_user_input[0].split())
+                    self._check_combinations(parsed_user_command)
                     parsed_input["input"].update(vars(parsed_user_command))
                     parsed_input["error"] = True
                     parsed_input["message"] = "Expected to get 2 lines in your cell magic, but got 1. \
                         Did you forget to include a query?\nTry `--help` or `-h`"
 
-                elif len(split_user_input) == 2:
+                elif len(split_user_input) == 2 or split_user_input[0].split()[:1] in self.multi_line_commands:
                     parsed_user_command = self.cell_parser.parse_args(split_user_input[0].split())
+                    self._check_combinations(parsed_user_command)
                     parsed_user_query = split_user_input[1]
 
+                    # msearch takes one query per line, as many lines as you like
+                    if parsed_user_command.command == "msearch":
+                        parsed_user_query = [line.strip() for line in split_user_input[1:] if line.strip()]
+
+                    # ES|QL and SQL queries are often spread over several lines
+                    if parsed_user_command.command in ("esql", "sql"):
+                        parsed_user_query = "\n".join(split_user_input[1:]).strip()
+
                     # add the parsed user arguments
                     parsed_input["input"].update(vars(parsed_user_command))
                     # add the **kwargs ("search_opts" from es_full)